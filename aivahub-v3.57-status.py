@@ -11,11 +11,13 @@ import openai
 import psycopg2
 from psycopg2 import Error
 from guide import guidelines_prompt
+from dispatch import dispatch_reviews, parse_answer
+from classifier import ReviewClassifier
+from tune_data import exists_query
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from transformers import GPT2Tokenizer
 
-from langchain import OpenAI, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import OpenAI
 
 from dotenv import load_dotenv
 
@@ -103,12 +105,11 @@ def load_fine_tune(cursor):
 
     return guidelines_prompt
 
-# Function to check if a review exists in the table
+# Function to check if a review exists in the table, through the unique
+# md5(review) index (tune_data.py)
 def review_exists(cursor, review):
-    query = "SELECT COUNT(*) FROM tune_data4 WHERE 'review' = %s"
-    cursor.execute(query, (review,))
-    count = cursor.fetchone()[0]
-    return count > 0
+    cursor.execute(exists_query, (review,))
+    return cursor.fetchone() is not None
 
 def has_unicode_characters(text):
     for char in text:
@@ -152,9 +153,6 @@ def openAI():
         # Call the function to create the fine_tune variable
         guidelines_prompt = load_fine_tune(cursor)
 
-        from langchain.prompts.few_shot import FewShotPromptTemplate
-        from langchain.prompts.prompt import PromptTemplate
-
         # Read the CSV file
         # with open("csv/B00UFJNVTS - Heat Resistant Oven Mitts (2 pack)_ High Temperatu 2023-06-07.csv", "r") as file:
         with open("csv/20230630 - B0050FRY5Y - Reviews SMCS - PATRICK REVIEW.csv", "r") as file:    
@@ -178,82 +176,60 @@ def openAI():
                 print("Title, body, and/or ratings columns not found in the CSV file.")
                 return
 
-            # Process each row in the CSV file
-            for i, row in enumerate(csv_reader, start=1):
-
-                # Extract the title and body from the CSV row
-                title = row[title_column]
-                body = row[body_column]
-                rating = row[ratings_column]
-
-                # Check if the title or body is None
-                if title is None or body is None:
-                    continue
-
-                # Check if the rating value is 4 or 5
-                elif rating in ['4', '5']:
-                    continue
-
-                elif rating in ['1', '2', '3']:# and i == 12:
-                    total += 1
-                    # Combine the title and body columns with a comma separator
-                    review = f"{body}"
-                    unicode = has_unicode_characters(review)
-                    review = correct_spanish_text(review)
-
-                    if unicode == True:                    
-                        review = remove_unicode(review)
-
-                    result = {'review': review}
-                    data_examples = [result]
-                
-                    example_prompt = PromptTemplate(
-                        input_variables=["review"],
-                        template='Review: \'{review}\'\nStatus: \nReason: \nResult:'
-                    )
-
-                    few_shot_template = FewShotPromptTemplate(
-                        examples=data_examples,
-                        example_prompt=example_prompt,
-                        prefix=guidelines_prompt,
-                        suffix='Review: \'{input}\'\nStatus: \nReason: \nResult:',
-                        input_variables=["input"]
-                    )
-
-                    chat_llm = ChatOpenAI(temperature=0.5)
-                    llm_chain = LLMChain(llm=chat_llm, prompt=few_shot_template)
-
-                    answer = llm_chain.run(review)
-                    # print(str(i) + " " + answer + '\n')
-
-                    # Extract reason
-                    reason_start = answer.find("Reason:") + len("Reason:")
-                    reason_end = answer.find("Result:")
-                    reason = answer[reason_start:reason_end].strip()
-
-                    # Extract status
-                    status_start = answer.find("Status:") + len("Status:")
-                    status_end = answer.find("\nReason:")
-                    status = answer[status_start:status_end].strip()
-
-                    # Extract result
-                    result_start = answer.find("Result:") + len("Result:")
-                    result = answer[result_start:].strip()
-
-                    print(i)
-                    print("Review:", review)
-                    print("Reason:", reason)
-                    print("Status:", status)
-                    print("Result:", result + '\n')
-
-                    if result.lower() == 'no':
-                        no_count += 1
-                    elif result.lower() == 'yes':
-                        yes_count += 1
-                    elif 'maybe' in result.lower():
-                        maybe_count += 1
-                    else:
-                        not_applicable += 1
+            # Build the prompt prefix, client and chain once for the whole job
+            classifier = ReviewClassifier(guidelines_prompt)
+
+            def read_reviews():
+                # Yield (i, review) for every 1-3 star review in file order
+                for i, row in enumerate(csv_reader, start=1):
+
+                    # Extract the title and body from the CSV row
+                    title = row[title_column]
+                    body = row[body_column]
+                    rating = row[ratings_column]
+
+                    # Check if the title or body is None
+                    if title is None or body is None:
+                        continue
+
+                    # Check if the rating value is 4 or 5
+                    elif rating in ['4', '5']:
+                        continue
+
+                    elif rating in ['1', '2', '3']:# and i == 12:
+                        review = f"{body}"
+                        unicode = has_unicode_characters(review)
+                        review = correct_spanish_text(review)
+
+                        if unicode == True:
+                            review = remove_unicode(review)
+
+                        yield i, review
+
+            def classify(item):
+                i, review = item
+
+                return classifier.run(review)
+
+            # Classify the reviews concurrently, results come back in file order
+            for (i, review), answer in dispatch_reviews(read_reviews(), classify):
+                total += 1
+                status, reason, result = parse_answer(answer)
+
+                print(i)
+                print("Review:", review)
+                print("Reason:", reason)
+                print("Status:", status)
+                print("Result:", result + '\n')
+
+                if result.lower() == 'no':
+                    no_count += 1
+                elif result.lower() == 'yes':
+                    yes_count += 1
+                elif 'maybe' in result.lower():
+                    maybe_count += 1
+                else:
+                    not_applicable += 1
 
             # Print the counts
             print("'Total' count:", total)
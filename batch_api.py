@@ -0,0 +1,267 @@
+import os
+import sys
+import csv
+import json
+import time
+import requests
+from dotenv import load_dotenv
+
+from db import connection
+from pipeline import ReviewPipeline
+from reviews import find_review_columns, read_reviews
+from results_table import ResultWriter, ensure_results_table, notify_upload, start_summary
+
+load_dotenv()
+
+# Offline lane for large, non-urgent uploads: every review that needs the model
+# is written to a Batch API JSONL file, submitted, polled and stored back with
+# the same parsing as the online path in t67.py.
+
+openai_api_base = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+poll_interval = int(os.getenv('BATCH_POLL_INTERVAL', '60'))  # seconds
+final_statuses = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class OpenAIBatchClient:
+    # Files and Batches endpoints of the OpenAI API
+
+    def __init__(self, api_key=None):
+        self.headers = {'Authorization': f"Bearer {api_key or os.getenv('OPENAI_API_KEY')}"}
+
+    def upload(self, path):
+        with open(path, 'rb') as file:
+            response = requests.post(
+                f'{openai_api_base}/files',
+                headers=self.headers,
+                files={'file': file},
+                data={'purpose': 'batch'}
+            )
+        response.raise_for_status()
+        return response.json()['id']
+
+    def create(self, file_id):
+        response = requests.post(
+            f'{openai_api_base}/batches',
+            headers=self.headers,
+            json={'input_file_id': file_id, 'endpoint': '/v1/chat/completions', 'completion_window': '24h'}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, batch_id):
+        response = requests.get(f'{openai_api_base}/batches/{batch_id}', headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def results(self, batch):
+        # Output lines of a finished batch, streamed instead of loaded at once
+        for key in ('output_file_id', 'error_file_id'):
+            file_id = batch.get(key)
+            if not file_id:
+                continue
+            response = requests.get(f'{openai_api_base}/files/{file_id}/content', headers=self.headers, stream=True)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+class LocalBatchClient:
+    # Stand-in for OpenAIBatchClient that answers every request right away
+    # with complete(prompt); for tests and local runs without the API
+
+    def __init__(self, complete):
+        self.complete = complete
+        self.files = {}
+        self.batches = {}
+
+    def upload(self, path):
+        file_id = f'file-{len(self.files) + 1}'
+        self.files[file_id] = path
+        return file_id
+
+    def create(self, file_id):
+        batch_id = f'batch-{len(self.batches) + 1}'
+        self.batches[batch_id] = {'id': batch_id, 'status': 'completed', 'input_file_id': file_id}
+        return self.batches[batch_id]
+
+    def get(self, batch_id):
+        return self.batches[batch_id]
+
+    def results(self, batch):
+        with open(self.files[batch['input_file_id']], 'r') as file:
+            for line in file:
+                request = json.loads(line)
+                content = self.complete(request['body']['messages'][0]['content'])
+                yield {
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 200, 'body': {'choices': [{'message': {'content': content}}]}},
+                    'error': None,
+                }
+
+
+def batch_request(custom_id, prompt, chat_llm):
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {
+            'model': chat_llm.model_name,
+            'temperature': chat_llm.temperature,
+            'messages': [{'role': 'user', 'content': prompt}],
+        },
+    }
+
+
+def write_batch_file(path, items, pipeline):
+    # Write one request per review that needs the model. Returns the answers
+    # of reviews settled locally (triage or caches) and the number written.
+    local_answers = {}
+    written = 0
+
+    with open(path, 'w') as file:
+        for i, review, needs_llm in items:
+            if not needs_llm:
+                continue
+
+            cached = pipeline.lookup(review)
+            if cached is not None:
+                local_answers[i] = cached
+                continue
+
+            prompt = pipeline.classifier.build_prompt(review)
+            file.write(json.dumps(batch_request(f'row-{i}', prompt, pipeline.classifier.chat_llm)) + '\n')
+            written += 1
+
+    return local_answers, written
+
+
+def wait_for_batch(client, batch):
+    while batch['status'] not in final_statuses:
+        print(f"Batch {batch['id']} is {batch['status']}, checking again in {poll_interval} seconds...")
+        time.sleep(poll_interval)
+        batch = client.get(batch['id'])
+    return batch
+
+
+def read_batch_answers(client, batch):
+    # ({row number: answer text} for every request that succeeded, total tokens used)
+    answers = {}
+    tokens = 0
+    for line in client.results(batch):
+        response = line.get('response') or {}
+        if response.get('status_code') != 200:
+            print(f"Batch request {line.get('custom_id')} failed:", line.get('error'))
+            continue
+        row_no = int(line['custom_id'].split('-', 1)[1])
+        answers[row_no] = response['body']['choices'][0]['message']['content']
+        tokens += response['body'].get('usage', {}).get('total_tokens', 0)
+    return answers, tokens
+
+
+def fail_batch_upload(cursor, uuid):
+    cursor.execute(
+        "UPDATE csv_upload SET status = %s WHERE id = %s",
+        ("failed", uuid)
+    )
+    notify_upload(cursor, uuid, status="failed")
+
+
+def run_batch_job(conn, csv_path, uuid, client, pipeline=None):
+    cursor = conn.cursor()
+    ensure_results_table(cursor)
+    conn.commit()
+
+    with open(csv_path, 'r') as csv_file:
+        csv_reader = csv.DictReader(csv_file)
+        columns = find_review_columns(csv_reader.fieldnames)
+        if columns is None:
+            print("Title, body, and/or ratings columns not found in the CSV file.")
+            fail_batch_upload(cursor, uuid)
+            conn.commit()
+            return False
+        items = list(read_reviews(csv_reader, columns))
+
+    if pipeline is None:
+        pipeline = ReviewPipeline(conn)
+
+    start_summary(cursor, uuid, len(items))
+
+    batch_path = f"/tmp/{uuid}-batch.jsonl"
+    answers, written = write_batch_file(batch_path, items, pipeline)
+    print(f"{written} reviews written to {batch_path}, {len(answers)} settled locally")
+
+    model_answers = {}
+    batch_tokens = 0
+    if written:
+        batch = client.create(client.upload(batch_path))
+        print("Batch submitted:", batch['id'])
+        batch = wait_for_batch(client, batch)
+        print(f"Batch {batch['id']} finished: {batch['status']}")
+        model_answers, batch_tokens = read_batch_answers(client, batch)
+
+    for i, review, needs_llm in items:
+        if i in model_answers:
+            pipeline.remember(review, model_answers[i])
+
+    # Requests the batch lost (all of them when it failed, expired or was
+    # cancelled) go through the online path's concurrent dispatcher
+    leftovers = [item for item in items if item[2] and item[0] not in answers and item[0] not in model_answers]
+    if leftovers:
+        print(f"{len(leftovers)} reviews not answered by the batch, classifying them online")
+        for (i, review, needs_llm), verdict in pipeline.answers(leftovers):
+            answers[i] = verdict
+
+    # Store every row in file order, checkpointed as one chunk for /events
+    total = 0
+    with ResultWriter(conn, uuid, usage=lambda: batch_tokens + pipeline.classifier.tokens_used, chunk=1) as writer:
+        for i, review, needs_llm in items:
+            if not needs_llm:
+                writer.add(i, review, "N/A", "N/A", "N/A", "rating")
+                continue
+
+            total += 1
+            if i in model_answers:
+                answer, source = model_answers[i], 'model'
+            else:
+                answer, source = answers[i]
+
+            status, reason, result = pipeline.verdict(review, answer, source)
+            writer.add(i, review, status, reason, result.lower(), source)
+
+    pipeline.print_stats(total)
+    os.remove(batch_path)
+
+    cursor.execute(
+        "UPDATE csv_upload SET status = %s WHERE id = %s",
+        ("completed", uuid)
+    )
+    notify_upload(cursor, uuid, status="completed")
+    conn.commit()
+    return True
+
+
+if __name__ == '__main__':
+    # python batch_api.py <upload id>
+    from google.cloud import storage
+
+    if len(sys.argv) != 2:
+        print("Usage: python batch_api.py <upload id>")
+        sys.exit(1)
+
+    uuid = sys.argv[1]
+
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT filename FROM csv_upload WHERE id = %s", (uuid,))
+        row = cursor.fetchone()
+        if row is None:
+            print('Invalid file ID')
+            sys.exit(1)
+
+        # Download the file from the GCS bucket
+        temp_file_path = f"/tmp/{row[0]}"
+        storage.Client().get_bucket(os.getenv('BUCKET')).blob(row[0]).download_to_filename(temp_file_path)
+
+        run_batch_job(conn, temp_file_path, uuid, OpenAIBatchClient())
+        os.remove(temp_file_path)
@@ -0,0 +1,52 @@
+import os
+import csv
+import time
+
+from langchain import LLMChain
+from langchain.chat_models import ChatOpenAI
+from langchain.prompts.few_shot import FewShotPromptTemplate
+from langchain.prompts.prompt import PromptTemplate
+
+from guide import guidelines_prompt
+from classifier import ReviewClassifier
+
+# No request is sent, the key only has to be present to build the client
+os.environ.setdefault('OPENAI_API_KEY', 'sk-bench')
+
+# Compare the per-review prompt/chain construction against ReviewClassifier
+csv_file = 'output6K.csv'
+prefix = guidelines_prompt.format(fine_tune='')
+
+with open(csv_file, 'r') as file:
+    reviews = [row['Body'] for row in csv.DictReader(file) if row['Rating'] in ['1', '2', '3']]
+
+print("Reviews:", len(reviews))
+
+# Old path: template, client and chain are rebuilt for every review
+start = time.perf_counter()
+for review in reviews:
+    example_prompt = PromptTemplate(
+        input_variables=["review"],
+        template='Review: \'{review}\'\nStatus: \nReason: \nResult:'
+    )
+    few_shot_template = FewShotPromptTemplate(
+        examples=[{'review': review}],
+        example_prompt=example_prompt,
+        prefix=prefix,
+        suffix='Review: \'{input}\'\nStatus: \nReason: \nResult:',
+        input_variables=["input"]
+    )
+    chat_llm = ChatOpenAI(temperature=0.5)
+    llm_chain = LLMChain(llm=chat_llm, prompt=few_shot_template)
+    prompt = few_shot_template.format(input=review)
+per_review = time.perf_counter() - start
+
+# New path: everything static is built once
+start = time.perf_counter()
+classifier = ReviewClassifier(prefix)
+for review in reviews:
+    prompt = classifier.build_prompt(review)
+once_per_job = time.perf_counter() - start
+
+print(f"Per review:   {per_review:.3f}s ({per_review / len(reviews) * 1000:.3f} ms/review)")
+print(f"Once per job: {once_per_job:.3f}s ({once_per_job / len(reviews) * 1000:.3f} ms/review)")
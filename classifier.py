@@ -0,0 +1,164 @@
+import os
+import re
+import threading
+
+from langchain import LLMChain
+from langchain.chat_models import ChatOpenAI
+from langchain.prompts.prompt import PromptTemplate
+
+from dispatch import parse_answer
+from rate_limiter import call_with_limits, estimate_tokens
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Reviews per prompt in batch mode (1 disables batching) and the token
+# budget a batch may use for review text plus the expected answers
+batch_size = int(os.getenv('LLM_BATCH_SIZE', '1'))
+batch_tokens = int(os.getenv('LLM_BATCH_TOKENS', '3000'))
+# Items per batch including the ones that need no model call, so a long run
+# of 4-5 star rows is passed on instead of held back in one batch
+batch_items = int(os.getenv('LLM_BATCH_ITEMS', '100'))
+answer_tokens = 120
+
+# Same layout FewShotPromptTemplate produced: prefix, the review as the
+# single example, then the review again as the suffix, joined by blank lines
+review_template = 'Review: \'{review}\'\nStatus: \nReason: \nResult:'
+example_separator = '\n\n'
+
+batch_instructions = (
+    "Classify each of the following reviews on its own. Answer every review in order, "
+    "starting each answer with its ID line exactly as given:\n"
+    "ID: <id>\nStatus: \nReason: \nResult:"
+)
+batch_review_template = 'ID: {id}\nReview: \'{review}\''
+batch_id_pattern = re.compile(r'^\s*ID:\s*(\w+)\s*$', re.MULTILINE)
+
+
+def make_batches(items, size=None, budget=None, weight=None, length=None):
+    # Group items into lists of at most `size` reviews whose estimated tokens
+    # stay within `budget`. weight(item) returns the review's token estimate,
+    # or None for items that need no model call; those ride along for free,
+    # up to `length` items per batch in all.
+    if size is None:
+        size = batch_size
+    if budget is None:
+        budget = batch_tokens
+    if length is None:
+        length = batch_items
+
+    batch = []
+    count = 0
+    used = 0
+
+    for item in items:
+        tokens = weight(item) if weight else estimate_tokens(item)
+
+        if tokens is not None:
+            tokens += answer_tokens
+        full = count and tokens is not None and (count >= size or used + tokens > budget)
+
+        if full or len(batch) >= length:
+            yield batch
+            batch = []
+            count = 0
+            used = 0
+
+        if tokens is not None:
+            count += 1
+            used += tokens
+
+        batch.append(item)
+
+    if batch:
+        yield batch
+
+
+def parse_batch_answer(answer):
+    # Split a batch answer into {id: answer text}; items without a Status
+    # and Result are left out so the caller can retry them one by one
+    parts = batch_id_pattern.split(answer)
+    answers = {}
+
+    for item_id, text in zip(parts[1::2], parts[2::2]):
+        if "Status:" in text and "Result:" in text:
+            answers[item_id] = text.strip()
+
+    return answers
+
+
+class ReviewClassifier:
+    # Holds everything that is static for a job: the rendered guidelines
+    # prefix, the chat client and the chain. Only the review text changes
+    # between calls, so the cost per review no longer grows with the prompt.
+
+    def __init__(self, guidelines_prompt, temperature=0.5, prompts=None):
+        self.prefix = guidelines_prompt + example_separator
+        # Optional per-review prefixes: any object with for_reviews(reviews),
+        # e.g. guideline_pruning.PrunedPrompts or example_index.SimilarExamplePrompts
+        self.prompts = prompts
+        # Retries are handled by call_with_limits, not by the client
+        self.chat_llm = ChatOpenAI(temperature=temperature, max_retries=0)
+
+        # Estimated prompt plus answer tokens of every call, for the upload summary
+        self.tokens_used = 0
+        self.tokens_lock = threading.Lock()
+
+        # The prompt is rendered by build_prompt, the chain only passes it on
+        self.llm_chain = LLMChain(
+            llm=self.chat_llm,
+            prompt=PromptTemplate(input_variables=["prompt"], template="{prompt}")
+        )
+
+    def prefix_for(self, reviews):
+        if self.prompts is None:
+            return self.prefix
+        return self.prompts.for_reviews(reviews) + example_separator
+
+    def build_prompt(self, review):
+        block = review_template.format(review=review)
+        return self.prefix_for([review]) + block + example_separator + block
+
+    def complete(self, prompt, answers=1):
+        # Send one prompt through the shared request/token limiter
+        tokens = estimate_tokens(prompt) + answer_tokens * answers
+        answer = call_with_limits(lambda: self.llm_chain.run(prompt), tokens)
+
+        with self.tokens_lock:
+            self.tokens_used += estimate_tokens(prompt) + estimate_tokens(answer)
+        return answer
+
+    def run(self, review):
+        # Raw model answer for a single review
+        return self.complete(self.build_prompt(review))
+
+    def build_batch_prompt(self, reviews):
+        blocks = [
+            batch_review_template.format(id=item_id, review=review)
+            for item_id, review in enumerate(reviews, start=1)
+        ]
+        return self.prefix_for(reviews) + batch_instructions + example_separator + example_separator.join(blocks)
+
+    def run_batch(self, reviews):
+        # Raw answers for several reviews sent in one prompt, in input order.
+        # Missing or malformed items fall back to a single-review call.
+        if not reviews:
+            return []
+        if len(reviews) == 1:
+            return [self.run(reviews[0])]
+
+        answers = parse_batch_answer(self.complete(self.build_batch_prompt(reviews), len(reviews)))
+
+        results = []
+        for item_id, review in enumerate(reviews, start=1):
+            answer = answers.get(str(item_id))
+            if answer is None:
+                print(f"Batch answer missing for item {item_id}, retrying it on its own.")
+                answer = self.run(review)
+            results.append(answer)
+
+        return results
+
+    def classify(self, review):
+        # (status, reason, result) for a single review
+        return parse_answer(self.run(review))
@@ -13,6 +13,8 @@ from langchain.prompts.prompt import PromptTemplate
 
 from dotenv import load_dotenv
 
+from prompt_cache import prompt_cache
+
 load_dotenv()
 
 openai_api_key = os.getenv('OPENAI_API_KEY')
@@ -67,15 +69,8 @@ try:
     # Create a cursor object to execute SQL queries
     cursor = conn.cursor()
 
-    # Execute the query to retrieve the guidelines_prompt from the database
-    query = "SELECT guidelines FROM guidelines_prompt WHERE id = 4;"
-    cursor.execute(query)
-
-    # Fetch the result
-    result = cursor.fetchone()
-
-    # Extract the guidelines_prompt from the result
-    guidelines_prompt = result[0]
+    # Retrieve the guidelines_prompt, cached until the guidelines_prompt table changes
+    guidelines_prompt = prompt_cache.guidelines(cursor, 4)
 
     # Iterate over the rows and extract the required columns
     for row in rows:
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Retrieve the PostgreSQL connection details from environment variables
+db_host = os.getenv('HOST')
+db_port = os.getenv('DB_PORT')
+db_name = os.getenv('DATABASE')
+db_user = os.getenv('DB_USER')
+db_password = os.getenv('PASSWORD')
+
+pool_min = int(os.getenv('DB_POOL_MIN', '1'))
+pool_max = int(os.getenv('DB_POOL_MAX', '10'))
+# Connections idle longer than this are checked with SELECT 1 before use
+health_check_after = float(os.getenv('DB_HEALTH_CHECK_AFTER', '30'))  # seconds
+
+max_retries = 10
+retry_delay = 5  # seconds
+
+
+def connect():
+    # Dedicated autocommit connection outside the pool, for long-lived
+    # listeners that would otherwise hold a pool slot forever
+    conn = psycopg2.connect(
+        user=db_user,
+        password=db_password,
+        host=db_host,
+        port=db_port,
+        database=db_name
+    )
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+
+class ConnectionPool:
+    # Thread-safe pool of autocommit connections. Checkout blocks while all
+    # pool_max connections are in use, dead connections are replaced.
+
+    def __init__(self, minconn=None, maxconn=None):
+        self.minconn = minconn or pool_min
+        self.maxconn = maxconn or pool_max
+        self.pool = None
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.lock = threading.Lock()
+        self.last_used = {}
+        self.in_use = 0
+        self.checkouts = 0
+        self.reconnects = 0
+        self.wait_time = 0.0
+
+    def open(self):
+        # Create the underlying pool, retrying like connect_to_database did
+        retry_count = 0
+
+        while True:
+            try:
+                self.pool = pool.ThreadedConnectionPool(
+                    self.minconn,
+                    self.maxconn,
+                    user=db_user,
+                    password=db_password,
+                    host=db_host,
+                    port=db_port,
+                    database=db_name
+                )
+                print('Connected to Cloud SQL PostgreSQL database')
+                return
+            except psycopg2.Error as e:
+                print('Error connecting to Cloud SQL PostgreSQL database:', e)
+                retry_count += 1
+                if retry_count >= max_retries:
+                    raise
+                print(f'Retrying connection ({retry_count}/{max_retries})...')
+                time.sleep(retry_delay)
+
+    def healthy(self, conn):
+        if conn.closed:
+            return False
+
+        idle = time.monotonic() - self.last_used.get(id(conn), 0)
+        if idle < health_check_after:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        with self.lock:
+            if self.pool is None:
+                self.open()
+
+        # Get a healthy connection, replacing any that dropped while idle
+        for _ in range(self.maxconn + 1):
+            conn = self.pool.getconn()
+            if self.healthy(conn):
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                return conn
+            print('Discarding a dropped database connection, reconnecting...')
+            with self.lock:
+                self.reconnects += 1
+            self.pool.putconn(conn, close=True)
+
+        raise psycopg2.OperationalError('No healthy database connection available')
+
+    def putconn(self, conn, broken=False):
+        self.last_used[id(conn)] = time.monotonic()
+        self.pool.putconn(conn, close=broken or conn.closed)
+
+    @contextmanager
+    def connection(self):
+        # Check a connection out for the duration of the with block
+        start = time.monotonic()
+        self.slots.acquire()
+        with self.lock:
+            self.wait_time += time.monotonic() - start
+            self.in_use += 1
+            self.checkouts += 1
+
+        conn = None
+        broken = False
+        try:
+            conn = self.getconn()
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self.putconn(conn, broken)
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max': self.maxconn,
+                'in_use': self.in_use,
+                'open': len(self.pool._pool) + len(self.pool._used) if self.pool else 0,
+                'checkouts': self.checkouts,
+                'reconnects': self.reconnects,
+                'avg_wait_ms': round(self.wait_time / self.checkouts * 1000, 2) if self.checkouts else 0,
+            }
+
+
+# Shared by every request handler and job of the process
+db_pool = ConnectionPool()
+
+
+def connection():
+    return db_pool.connection()
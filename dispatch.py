@@ -0,0 +1,75 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Maximum number of LLM requests allowed in flight at the same time
+max_in_flight = int(os.getenv('LLM_MAX_IN_FLIGHT', '8'))
+
+
+def parse_answer(answer):
+    # Extract reason
+    reason_start = answer.find("Reason:") + len("Reason:")
+    reason_end = answer.find("Result:")
+    reason = answer[reason_start:reason_end].strip()
+
+    # Extract status
+    status_start = answer.find("Status:") + len("Status:")
+    status_end = answer.find("\nReason:")
+    status = answer[status_start:status_end].strip()
+
+    # Extract result
+    result_start = answer.find("Result:") + len("Result:")
+    result = answer[result_start:].strip()
+
+    return status, reason, result
+
+
+def normalize_result(result):
+    # 'no', 'yes', 'maybe' or 'N/A', the values counted and stored per review
+    if result.lower() == 'no':
+        return 'no'
+    elif result.lower() == 'yes':
+        return 'yes'
+    elif 'maybe' in result.lower():
+        return 'maybe'
+    return 'N/A'
+
+
+def format_answer(status, reason, result):
+    # Inverse of parse_answer, for verdicts that did not come from the model
+    return f"Status: {status}\nReason: {reason}\nResult: {result}"
+
+
+def dispatch_reviews(items, classify, limit=None):
+    # Run classify(item) for every item on a thread pool and yield
+    # (item, answer) pairs in input order. At most `limit` calls are
+    # pending at once, so a large CSV never floods the API or memory.
+    if limit is None:
+        limit = max_in_flight
+
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        for item in items:
+            pending.append((item, executor.submit(classify, item)))
+
+            # Wait for the oldest request before submitting more
+            if len(pending) >= limit:
+                head, future = pending.popleft()
+                yield head, future.result()
+
+        while pending:
+            head, future = pending.popleft()
+            yield head, future.result()
+
+
+def dispatch_batches(batches, classify_batch, limit=None):
+    # Like dispatch_reviews, but each call handles a whole batch and returns
+    # one answer per item; pairs are yielded item by item in input order
+    for batch, answers in dispatch_reviews(batches, classify_batch, limit):
+        for item, answer in zip(batch, answers):
+            yield item, answer
@@ -0,0 +1,67 @@
+import os
+import time
+from dotenv import load_dotenv
+
+from classifier import ReviewClassifier
+from db import db_pool
+from dispatch import dispatch_reviews, parse_answer
+from few_shot import example_count, load_fine_tune_examples, render_guidelines
+from guideline_pruning import PrunedPrompts
+from rate_limiter import estimate_tokens
+
+load_dotenv()
+
+# Compare full and pruned guideline prompts against the tune_data4 human labels
+
+eval_limit = int(os.getenv('EVAL_LIMIT', '200'))
+
+conn = db_pool.getconn()
+cursor = conn.cursor()
+fine_tune = load_fine_tune_examples(cursor)
+guidelines_prompt = render_guidelines(fine_tune)
+
+# Labelled reviews that are not already used as prompt examples; same
+# order as few_shot.examples_query
+cursor.execute(
+    "SELECT review, human_result FROM tune_data4 ORDER BY md5(review) OFFSET %s LIMIT %s",
+    (example_count, eval_limit)
+)
+labelled = [(review, str(human_result).strip().lower()) for review, human_result in cursor.fetchall()]
+print("Labelled reviews:", len(labelled))
+
+
+def evaluate(name, classifier):
+    start = time.time()
+    prompt_tokens = 0
+    correct = 0
+    violations = 0
+    violations_found = 0
+
+    def classify(item):
+        return classifier.run(item[0])
+
+    for (review, human_result), answer in dispatch_reviews(labelled, classify):
+        status, reason, result = parse_answer(answer)
+        result = result.strip().lower()
+        prompt_tokens += estimate_tokens(classifier.build_prompt(review))
+
+        if result == human_result:
+            correct += 1
+        if human_result == 'yes':
+            violations += 1
+            if result == 'yes' or 'maybe' in result:
+                violations_found += 1
+
+    print(f"{name}:")
+    print(f"  Accuracy:          {correct / len(labelled):.1%}")
+    if violations:
+        print(f"  Violation recall:  {violations_found / violations:.1%}")
+    print(f"  Prompt tokens/rev: {prompt_tokens / len(labelled):.0f}")
+    print(f"  Time:              {time.time() - start:.1f}s")
+
+
+if labelled:
+    evaluate("Full guidelines", ReviewClassifier(guidelines_prompt))
+    evaluate("Pruned guidelines", ReviewClassifier(guidelines_prompt, prompts=PrunedPrompts(fine_tune)))
+
+db_pool.putconn(conn)
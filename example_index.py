@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from few_shot import format_example
+from guideline_pruning import build_pruned_prompt, select_sections, sections
+from prompt_cache import prompt_cache
+from rate_limiter import estimate_tokens
+
+load_dotenv()
+
+# 'fixed' keeps the first 12 tune_data4 rows in every prompt, 'similar'
+# picks the k most similar labelled reviews for each review
+few_shot_mode = os.getenv('FEW_SHOT_MODE', 'fixed')
+few_shot_k = int(os.getenv('FEW_SHOT_K', '6'))
+few_shot_tokens = int(os.getenv('FEW_SHOT_TOKENS', '1200'))
+index_path = os.getenv('EXAMPLE_INDEX_PATH', 'example_index.npz')
+
+dim = 1024
+
+rows_query = "SELECT review, ai_reason, ai_status, ai_result, human_reason, human_status, human_result FROM tune_data4"
+
+
+def features(text):
+    # Words and word pairs of the text
+    words = re.findall(r'\w+', str(text).lower())
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+
+def embed(text):
+    # Hashed term counts, a cheap CPU embedding that needs no model download
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature in features(text):
+        vec[zlib.crc32(feature.encode('utf-8')) % dim] += 1
+    return vec
+
+
+def review_digest(review):
+    return hashlib.md5(str(review).encode('utf-8')).hexdigest()
+
+
+class ExampleIndex:
+    # Brute-force cosine index over the human-labelled tune_data4 rows,
+    # TF-IDF weighted over hashed features. Saved next to the code so
+    # workers load it instead of re-reading the whole table.
+
+    def __init__(self):
+        self.rows = []
+        self.digests = set()
+        self.counts = np.zeros((0, dim), dtype=np.float32)
+        self.df = np.zeros(dim, dtype=np.float32)
+        self.weighted = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def version(self):
+        # Changes whenever labelled rows are added
+        return hashlib.sha256('\n'.join(sorted(self.digests)).encode('utf-8')).hexdigest()
+
+    def add(self, rows):
+        # Add (review, ai_reason, ai_status, ai_result, human_reason,
+        # human_status, human_result) rows not indexed yet; returns how many
+        new_rows = []
+        for row in rows:
+            digest = review_digest(row[0])
+            if digest not in self.digests:
+                self.digests.add(digest)
+                new_rows.append(tuple(row))
+
+        if not new_rows:
+            return 0
+
+        vectors = np.stack([embed(row[0]) for row in new_rows])
+
+        with self.lock:
+            self.rows.extend(new_rows)
+            self.counts = np.vstack([self.counts, vectors])
+            self.df += (vectors > 0).sum(axis=0)
+            self.weighted = None
+
+        return len(new_rows)
+
+    def refresh(self, cursor):
+        # Index rows added to tune_data4 since the last refresh, e.g. by excel-db.py
+        cursor.execute("SELECT COUNT(*) FROM tune_data4")
+        if cursor.fetchone()[0] <= len(self.rows):
+            return 0
+
+        cursor.execute("SELECT md5(review) FROM tune_data4")
+        missing = [digest for (digest,) in cursor.fetchall() if digest not in self.digests]
+        if not missing:
+            return 0
+
+        cursor.execute(rows_query + " WHERE md5(review) = ANY(%s)", (missing,))
+        return self.add(cursor.fetchall())
+
+    def idf(self):
+        return np.log((1 + len(self.rows)) / (1 + self.df)) + 1
+
+    def matrix(self):
+        with self.lock:
+            if self.weighted is None:
+                weighted = self.counts * self.idf()
+                norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+                self.weighted = weighted / np.maximum(norms, 1e-9)
+            return self.weighted
+
+    def search(self, review, k):
+        # Rows of the k most similar labelled reviews, most similar first
+        if not self.rows:
+            return []
+
+        matrix = self.matrix()
+        query = embed(review) * self.idf()
+        query /= max(np.linalg.norm(query), 1e-9)
+
+        scores = matrix @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [self.rows[i] for i in top]
+
+    def select(self, reviews, k=None, budget=None):
+        # Formatted examples for the reviews of a prompt within the token budget
+        if k is None:
+            k = few_shot_k
+        if budget is None:
+            budget = few_shot_tokens
+
+        chosen = []
+        seen = set()
+        for review in reviews:
+            for row in self.search(review, k):
+                if row[0] not in seen:
+                    seen.add(row[0])
+                    chosen.append(row)
+
+        fine_tune = ''
+        used = 0
+        for row in chosen:
+            example = format_example(row)
+            tokens = estimate_tokens(example)
+            if fine_tune and used + tokens > budget:
+                break
+            fine_tune += example
+            used += tokens
+
+        return fine_tune
+
+    def save(self, path=None):
+        path = path or index_path
+        with self.lock:
+            np.savez(
+                path,
+                counts=self.counts,
+                rows=np.array(json.dumps([[str(value) for value in row] for row in self.rows]))
+            )
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or index_path
+        index = cls()
+        if os.path.exists(path):
+            data = np.load(path)
+            rows = [tuple(row) for row in json.loads(str(data['rows']))]
+            index.rows = rows
+            index.digests = {review_digest(row[0]) for row in rows}
+            index.counts = data['counts'].astype(np.float32)
+            index.df = (index.counts > 0).sum(axis=0).astype(np.float32)
+        return index
+
+
+class SimilarExamplePrompts:
+    # Prompt prefixes with the most similar labelled examples for the
+    # reviews being sent, optionally with pruned guideline sections
+
+    def __init__(self, index, pruned=False):
+        self.index = index
+        self.pruned = pruned
+
+    def for_reviews(self, reviews):
+        fine_tune = self.index.select(reviews)
+
+        if self.pruned:
+            numbers = set()
+            for review in reviews:
+                numbers.update(select_sections(review))
+            numbers = sorted(numbers)
+        else:
+            numbers = sorted(sections)
+
+        return build_pruned_prompt(numbers, fine_tune)
+
+
+example_index = None
+example_index_version = None
+example_index_lock = threading.Lock()
+
+
+def get_example_index(cursor):
+    # Process-wide index, loaded from disk and topped up from tune_data4
+    global example_index, example_index_version
+
+    with example_index_lock:
+        if example_index is None:
+            example_index = ExampleIndex.load()
+
+        # Only look at tune_data4 again after it changed
+        version = prompt_cache.version('tune_data4')
+        if version != example_index_version:
+            added = example_index.refresh(cursor)
+            if added:
+                print(f"Example index: added {added} labelled reviews ({len(example_index)} total)")
+                example_index.save()
+            example_index_version = version
+
+        return example_index
@@ -8,6 +8,9 @@ from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from dotenv import load_dotenv
 import csv
 
+from example_index import ExampleIndex
+from tune_data import ingest_labelled_reviews
+
 load_dotenv()
 
 # Retrieve the PostgreSQL connection details from environment variables
@@ -57,25 +60,15 @@ df = pd.read_csv(csv_file)
 # Combine "Title" and "Body" columns into "review" column
 df['review'] = df['Title'] + ' ' + df['Body']
 
-# Check if each "review" already exists in the table
-existing_reviews = set()
-with conn.cursor() as cursor:
-    cursor.execute("SELECT review FROM tune_data4;")
-    rows = cursor.fetchall()
-    existing_reviews = set(row[0] for row in rows)
-
-# Insert each row into the "tune_data4" table if it doesn't already exist
-with conn.cursor() as cursor:
-    for index, row in df.iterrows():
-        review = row['review']
-        if review not in existing_reviews:
-            try:
-                values = (review, row['ai_reason'], row['ai_status'], row['ai_result'], row['human_reason'], row['human_status'], row['human_result'])
-                insert_query = "INSERT INTO tune_data4 (review, ai_reason, ai_status, ai_result, human_reason, human_status, human_result) VALUES (%s, %s, %s, %s, %s, %s, %s);"
-                cursor.execute(insert_query, values)
-            except psycopg2.errors.StringDataRightTruncation as e:
-                print(f'Error: {e}')
-                print('Skipping row due to data truncation.')
-                continue
+# Stage the rows with COPY and merge them into tune_data4 in one statement;
+# reviews already stored are skipped by the unique md5(review) index
+inserted_rows, counts = ingest_labelled_reviews(conn, df)
 
 print('Data insertion complete.')
+print(f"Inserted: {counts['inserted']}, skipped: {counts['skipped']}, truncated: {counts['truncated']}")
+
+# Add the new labelled reviews to the few-shot example index
+example_index = ExampleIndex.load()
+added = example_index.add(inserted_rows)
+example_index.save()
+print(f'Example index updated: {added} added, {len(example_index)} total.')
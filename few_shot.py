@@ -0,0 +1,38 @@
+from guide import guidelines_prompt
+
+# Human-labelled examples baked into every prompt, in the order of the
+# unique md5(review) index (tune_data.py) so every job gets the same ones
+example_count = 12
+examples_query = f"SELECT * FROM tune_data4 ORDER BY md5(review) LIMIT {example_count}"
+
+
+def format_example(row):
+    # tune_data4 columns: review, ai_reason, ai_status, ai_result,
+    # human_reason, human_status, human_result. Only the human labels are used.
+    review = row[0]
+    status2 = str(row[5])
+    reason2 = row[4]
+    result2 = str(row[6])
+
+    return (
+        '"review": "' + str(review) + '",\n' +
+        '"status": "' + status2 + '",\n' +
+        '"reason": "' + str(reason2) + '",\n' +
+        '"result": "' + result2 + '"\n\n'
+    )
+
+
+def format_examples(rows):
+    return ''.join(format_example(row) for row in rows)
+
+
+def load_fine_tune_examples(cursor):
+    cursor.execute(examples_query)
+    # Fetch all the rows from the result set
+    return format_examples(cursor.fetchall())
+
+
+def render_guidelines(fine_tune):
+    # Replace {fine_tune} with the actual value. The guide.py template is left
+    # untouched so every job picks up the current tune_data4 examples.
+    return guidelines_prompt.format(fine_tune=fine_tune)
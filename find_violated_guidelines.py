@@ -27,15 +27,16 @@ def find_violated_guidelines(review):
     return violated_guidelines
 
 
-# Example usage
-review = """Developed mold, I thought i did everything right. The model came out right but it started to develop mold. 
+if __name__ == '__main__':
+    # Example usage
+    review = """Developed mold, I thought i did everything right. The model came out right but it started to develop mold. 
 I’m not sure why this happened, but yes it did. Ok, so i did my second model two weeks later, and yes AGAIN, the mold started to appear... DO NOT BUY THIS PRODUCT!!!"""
 
-violated_guidelines = find_violated_guidelines(review)
+    violated_guidelines = find_violated_guidelines(review)
 
-if violated_guidelines:
-    print("The review violates the following guidelines:")
-    for guideline_num in violated_guidelines:
-        print(f"- Guideline {guideline_num}")
-else:
-    print("The review does not violate any guidelines.")
+    if violated_guidelines:
+        print("The review violates the following guidelines:")
+        for guideline_num in violated_guidelines:
+            print(f"- Guideline {guideline_num}")
+    else:
+        print("The review does not violate any guidelines.")
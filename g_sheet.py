@@ -1,5 +1,8 @@
+import io
 import os
+import csv
 import time
+import hashlib
 import psycopg2
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
@@ -14,6 +17,9 @@ db_name = os.getenv('DATABASE')
 db_user = os.getenv('USER')
 db_password = os.getenv('PASSWORD')
 
+# Rows per range in the batched values read, one request for all ranges
+batch_rows = int(os.getenv('SHEET_BATCH_ROWS', '5000'))
+
 # Connect to the PostgreSQL database
 conn = psycopg2.connect(
     host=db_host,
@@ -23,9 +29,128 @@ conn = psycopg2.connect(
     password=db_password
 )
 
-# Function to read Google Sheets and create a PostgreSQL table for each sheet
+# Per-worksheet watermark: the hash of all row hashes at the last sync. A
+# worksheet whose hash did not change is skipped without touching its table.
+create_watermark_query = """
+CREATE TABLE IF NOT EXISTS sheet_sync (
+    sheet_id VARCHAR NOT NULL,
+    worksheet_id BIGINT NOT NULL,
+    title VARCHAR,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    content_hash CHAR(32),
+    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sheet_id, worksheet_id)
+)
+"""
+
+save_watermark_query = """
+INSERT INTO sheet_sync (sheet_id, worksheet_id, title, row_count, content_hash, synced_at)
+VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+ON CONFLICT (sheet_id, worksheet_id) DO UPDATE SET
+    title = EXCLUDED.title,
+    row_count = EXCLUDED.row_count,
+    content_hash = EXCLUDED.content_hash,
+    synced_at = EXCLUDED.synced_at
+"""
+
+
+def valid_column_name(name):
+    # Remove any special characters from column names to make them valid for PostgreSQL
+    return name.lower().replace(' ', '_').replace('-', '_')
+
+def row_hash(row):
+    return hashlib.md5('\x1f'.join(row).encode('utf-8')).hexdigest()
+
+def sheet_ranges(worksheet):
+    # A1 ranges covering the worksheet, batch_rows rows each
+    last_column = gspread.utils.rowcol_to_a1(1, max(worksheet.col_count, 1)).rstrip('0123456789')
+    return [
+        f"'{worksheet.title}'!A{start}:{last_column}{min(start + batch_rows - 1, worksheet.row_count)}"
+        for start in range(1, worksheet.row_count + 1, batch_rows)
+    ]
+
+def read_worksheets(spreadsheet, worksheets):
+    # {worksheet id: all rows} with one batched values request
+    ranges = {worksheet.id: sheet_ranges(worksheet) for worksheet in worksheets}
+    flat = [a1 for worksheet in worksheets for a1 in ranges[worksheet.id]]
+    value_ranges = spreadsheet.values_batch_get(flat).get('valueRanges', [])
+
+    values = {}
+    position = 0
+    for worksheet in worksheets:
+        rows = []
+        for value_range in value_ranges[position:position + len(ranges[worksheet.id])]:
+            rows.extend(value_range.get('values', []))
+        position += len(ranges[worksheet.id])
+        values[worksheet.id] = rows
+    return values
+
+def ensure_sheet_table(cursor, table_name, columns):
+    # All worksheets of a spreadsheet share one table; rows are keyed by
+    # worksheet and row number so edits replace the stored row
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
+        '"worksheet_id" BIGINT, "row_no" INTEGER, "row_hash" CHAR(32))'
+    )
+    for column_name in ['worksheet_id', 'row_no', 'row_hash'] + columns:
+        column_type = {'worksheet_id': 'BIGINT', 'row_no': 'INTEGER', 'row_hash': 'CHAR(32)'}.get(column_name, 'VARCHAR')
+        cursor.execute(f'ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS "{column_name}" {column_type}')
+    cursor.execute(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_row" ON "{table_name}" ("worksheet_id", "row_no")'
+    )
+
+def sync_worksheet(cursor, table_name, worksheet, rows):
+    # Upsert the new and changed rows of one worksheet; returns how many
+    column_names = [valid_column_name(name) for name in rows[0]] if rows else []
+    if not column_names:
+        return 0
+    ensure_sheet_table(cursor, table_name, column_names)
+
+    cursor.execute(
+        f'SELECT "row_no", "row_hash" FROM "{table_name}" WHERE "worksheet_id" = %s',
+        (worksheet.id,)
+    )
+    stored = dict(cursor.fetchall())
+
+    changed = []
+    for row_no, row in enumerate(rows[1:], start=2):
+        # The API drops trailing empty cells
+        row = (row + [''] * len(column_names))[:len(column_names)]
+        digest = row_hash(row)
+        if stored.get(row_no) != digest:
+            changed.append([worksheet.id, row_no, digest] + row)
+
+    # Rows removed from the end of the worksheet
+    cursor.execute(
+        f'DELETE FROM "{table_name}" WHERE "worksheet_id" = %s AND "row_no" > %s',
+        (worksheet.id, len(rows))
+    )
+
+    if not changed:
+        return 0
+
+    columns = ['worksheet_id', 'row_no', 'row_hash'] + column_names
+    quoted = ', '.join(f'"{name}"' for name in columns)
+    updates = ', '.join(f'"{name}" = EXCLUDED."{name}"' for name in columns[2:])
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(changed)
+    buffer.seek(0)
+
+    cursor.execute(f'CREATE TEMP TABLE sheet_staging (LIKE "{table_name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+    cursor.copy_expert(f'COPY sheet_staging ({quoted}) FROM STDIN WITH (FORMAT csv)', buffer)
+    cursor.execute(
+        f'INSERT INTO "{table_name}" ({quoted}) SELECT {quoted} FROM sheet_staging '
+        f'ON CONFLICT ("worksheet_id", "row_no") DO UPDATE SET {updates}'
+    )
+    return len(changed)
+
+# Function to sync a Google Spreadsheet into a PostgreSQL table, one
+# transaction per changed worksheet
 def read_google_sheets(sheet_id):
     cursor = conn.cursor()
+    cursor.execute(create_watermark_query)
+    conn.commit()
 
     # Set the credentials and scope for accessing Google Sheets API
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -34,57 +159,40 @@ def read_google_sheets(sheet_id):
     # Authorize the credentials and create a client
     client = gspread.authorize(credentials)
 
-    # Create a file to store the processed sheet_ids/option can be read/write from database
-    output_file_path = "sheets_processed.txt"
-    processed_sheets = set()
-
-    if os.path.exists(output_file_path):
-        with open(output_file_path, "r") as output_file:
-            processed_sheets = set(output_file.read().splitlines())
-
     while True:
         try:
             # Open the Google Spreadsheet by its ID
             spreadsheet = client.open_by_key(sheet_id)
+            worksheets = spreadsheet.worksheets()
+            values = read_worksheets(spreadsheet, worksheets)
 
-            # Check if the sheet_id has been processed before
-            if sheet_id in processed_sheets:
-                break
-
-            for worksheet in spreadsheet.worksheets():
-                column_names = worksheet.row_values(1)
+            cursor.execute(
+                "SELECT worksheet_id, content_hash FROM sheet_sync WHERE sheet_id = %s",
+                (sheet_id,)
+            )
+            watermarks = dict(cursor.fetchall())
 
-                # Remove any special characters from column names to make them valid for PostgreSQL
-                valid_column_names = [name.lower().replace(' ', '_').replace('-', '_') for name in column_names]
+            table_name = sheet_id
 
-                table_name = sheet_id
+            for worksheet in worksheets:
+                rows = values[worksheet.id]
+                content_hash = hashlib.md5(''.join(row_hash(row) for row in rows).encode('utf-8')).hexdigest()
 
-                # Create the PostgreSQL table if it doesn't exist
-                create_table_query = f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
+                # Unchanged since the last sync
+                if watermarks.get(worksheet.id) == content_hash:
+                    print(f"{worksheet.title}: unchanged")
+                    continue
 
-                for column_name in valid_column_names:
-                    create_table_query += f'"{column_name}" VARCHAR,'
-                
-                create_table_query = create_table_query.rstrip(',') + ');'
-
-                cursor.execute(create_table_query)
-                conn.commit()
-
-                # Insert data from the worksheet into the PostgreSQL table
-                all_values = worksheet.get_all_values()
-                headers = all_values[0]  # Use original column names
-                insert_query = f'INSERT INTO "{table_name}" ({", ".join(valid_column_names)}) VALUES ({", ".join(["%s"] * len(valid_column_names))})'
-
-                for row in all_values[1:]:
-                    cursor.execute(insert_query, row)
+                try:
+                    synced = sync_worksheet(cursor, table_name, worksheet, rows)
+                    cursor.execute(save_watermark_query, (sheet_id, worksheet.id, worksheet.title, len(rows), content_hash))
                     conn.commit()
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    print(f"{worksheet.title}: sync failed:", e)
+                    continue
 
-            # Add the sheet_id to the set of processed sheets
-            processed_sheets.add(sheet_id)
-
-            # Write the processed sheets back to the output file
-            with open(output_file_path, "w") as output_file:
-                output_file.write('\n'.join(processed_sheets))
+                print(f"{worksheet.title}: {synced} new or changed rows")
 
             break
 
@@ -101,10 +209,9 @@ def read_google_sheets(sheet_id):
 # Retrieve the spreadsheet ID from environment variables
 spreadsheet_id = os.getenv('SPREADSHEET_ID')
 
-# Call the function to read the Google Sheets and insert data into PostgreSQL tables
+# Call the function to sync the Google Sheets into PostgreSQL
 read_google_sheets(spreadsheet_id)
 
-
 # import os
 # import time
 # import psycopg2
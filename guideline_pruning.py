@@ -0,0 +1,96 @@
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+from guide import guidelines_prompt
+from find_violated_guidelines import find_violated_guidelines
+from triage import detect_pii, looks_supported_language
+
+load_dotenv()
+
+# Send only the guideline sections a review plausibly touches
+pruning_enabled = os.getenv('PRUNE_GUIDELINES', '0') == '1'
+# Sections sent with every review; 1 (seller/shipping) and 2 (pricing) are
+# the usual violations in 1-3 star reviews and have no reliable keywords
+always_include = [int(num) for num in os.getenv('PRUNE_ALWAYS_INCLUDE', '1,2').split(',') if num.strip()]
+
+
+def split_guidelines(template):
+    # (header, {number: section text}, footer) of the guide.py template; the
+    # footer holds the {fine_tune} examples and the answer format
+    parts = re.split(r'(?m)^    (?=\d+- )', template)
+    header = parts[0]
+    sections = {}
+
+    for part in parts[1:]:
+        number = int(part.split('-', 1)[0])
+        sections[number] = '    ' + part
+
+    last = max(sections)
+    footer_start = sections[last].index('    Example training dataset:')
+    footer = sections[last][footer_start:]
+    sections[last] = sections[last][:footer_start]
+
+    return header, sections, footer
+
+
+header, sections, footer = split_guidelines(guidelines_prompt)
+
+pruned_header = header.replace(
+    "comply with all 14 of Amazon's guidelines",
+    "comply with the following Amazon guidelines"
+)
+pruned_footer = footer.replace("of the said 14 guidelines", "of the guidelines above")
+
+
+def select_sections(review):
+    # Guideline numbers worth sending for this review, from cheap signals
+    selected = set(always_include)
+    selected.update(find_violated_guidelines(review))
+    selected.update(num for num, label in detect_pii(review))
+
+    # Too few words to judge the language reliably otherwise
+    words = re.findall(r'\w+', review.lower())
+    if len(words) >= 8 and not looks_supported_language(words):
+        selected.add(3)
+
+    if not re.search(r'[A-Za-z]', review):
+        selected.add(4)
+
+    return sorted(num for num in selected if num in sections)
+
+
+def build_pruned_prompt(numbers, fine_tune):
+    # Same layout as guidelines_prompt with only the chosen sections
+    if len(numbers) == len(sections):
+        return guidelines_prompt.format(fine_tune=fine_tune)
+
+    body = ''.join(sections[num] for num in numbers)
+    return pruned_header + body + pruned_footer.format(fine_tune=fine_tune)
+
+
+class PrunedPrompts:
+    # Rendered prefixes for each combination of sections seen so far
+
+    def __init__(self, fine_tune):
+        self.fine_tune = fine_tune
+        self.prompts = {}
+        self.lock = threading.Lock()
+
+    def for_sections(self, numbers):
+        key = tuple(numbers)
+        with self.lock:
+            prompt = self.prompts.get(key)
+            if prompt is None:
+                prompt = build_pruned_prompt(numbers, self.fine_tune)
+                self.prompts[key] = prompt
+            return prompt
+
+    def for_reviews(self, reviews):
+        # One prefix covering every review of a batch
+        numbers = set()
+        for review in reviews:
+            numbers.update(select_sections(review))
+        return self.for_sections(sorted(numbers))
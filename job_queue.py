@@ -0,0 +1,425 @@
+import os
+import sys
+import time
+import socket
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.connection
+
+import psycopg2
+from psycopg2.extras import Json
+from dotenv import load_dotenv
+
+import upload_jobs
+from db import connection
+from notify_listener import NotificationListener
+from results_table import notify_upload
+from scheduler import chunk_tags, clamp_priority, deadline_slack
+
+load_dotenv()
+
+# Broker-free alternative to the Celery tasks: jobs are rows in Postgres,
+# claimed with FOR UPDATE SKIP LOCKED, and idle workers wake on NOTIFY.
+#
+#   python job_queue.py setup                once, creates the jobs table
+#   python job_queue.py worker [processes]
+
+channel = 'jobs'
+# A claimed job not finished within this time is handed to another worker
+visibility_timeout = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '900'))  # seconds
+max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+retry_delay = int(os.getenv('JOB_RETRY_DELAY', '30'))  # seconds, times the attempt
+# Idle workers also look for work this often, in case a NOTIFY was missed
+idle_poll = float(os.getenv('JOB_IDLE_POLL', '30'))  # seconds
+# Wait before a worker retries after losing its database connection
+reconnect_delay = float(os.getenv('JOB_RECONNECT_DELAY', '5'))  # seconds
+
+# kind is 'upload' (split into chunks), 'chunk' or 'finalize'. status goes
+# queued -> running -> done, or back to queued for a retry, or to dead once
+# max_attempts are used up (the dead letters, kept for inspection). When a
+# stalled upload is resumed, its earlier jobs become superseded.
+create_jobs_query = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(16) NOT NULL,
+    upload_id UUID NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{{}}',
+    result JSONB,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT {max_attempts},
+    visible_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- Scheduling hints and queue-wait timestamps (scheduler.py)
+    priority INTEGER NOT NULL DEFAULT 1,
+    deadline TIMESTAMP,
+    sort_key DOUBLE PRECISION NOT NULL DEFAULT 0,
+    started_at TIMESTAMP
+);
+-- One index per claim order, see claim_query
+CREATE INDEX IF NOT EXISTS jobs_claim_fair ON jobs (sort_key, id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS jobs_claim_deadline ON jobs (deadline, id) WHERE status IN ('queued', 'running') AND deadline IS NOT NULL;
+CREATE INDEX IF NOT EXISTS jobs_upload ON jobs (upload_id, kind);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_one_live_finalize ON jobs (upload_id) WHERE kind = 'finalize' AND status <> 'superseded';
+
+CREATE OR REPLACE FUNCTION notify_jobs() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', NEW.kind);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS jobs_notify ON jobs;
+CREATE TRIGGER jobs_notify
+    AFTER INSERT OR UPDATE OF status ON jobs
+    FOR EACH ROW WHEN (NEW.status = 'queued')
+    EXECUTE PROCEDURE notify_jobs();
+"""
+
+# Queued jobs that are due, and running jobs whose worker went quiet past
+# the visibility timeout. Workers never wait on each other's locked rows.
+# claim() first looks for jobs of uploads close to their deadline, earliest
+# deadline first (jobs_claim_deadline), then takes the smallest fair queuing
+# tag (jobs_claim_fair, scheduler.py). {where} and {order} pick the pass.
+claim_query = """
+UPDATE jobs SET
+    status = 'running',
+    attempts = attempts + 1,
+    locked_by = %(worker_id)s,
+    visible_at = CURRENT_TIMESTAMP + make_interval(secs => %(timeout)s),
+    started_at = coalesce(started_at, CURRENT_TIMESTAMP),
+    updated_at = CURRENT_TIMESTAMP
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE status IN ('queued', 'running')
+      AND visible_at <= CURRENT_TIMESTAMP
+      AND attempts < max_attempts
+      {where}
+    ORDER BY {order}
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id, kind, upload_id, payload, attempts, priority, deadline
+"""
+
+claim_urgent_query = claim_query.format(
+    where="AND deadline IS NOT NULL AND deadline <= CURRENT_TIMESTAMP + make_interval(secs => %(slack)s)",
+    order="deadline, id"
+)
+claim_fair_query = claim_query.format(where="", order="sort_key, id")
+
+# Current virtual time: the smallest tag still waiting or running
+virtual_time_query = "SELECT coalesce(min(sort_key), 0) FROM jobs WHERE kind = 'chunk' AND status IN ('queued', 'running')"
+
+# Queue wait of the active uploads
+queue_stats_query = """
+SELECT
+    upload_id,
+    max(priority),
+    max(deadline),
+    count(*) FILTER (WHERE status = 'queued'),
+    count(*) FILTER (WHERE status = 'running'),
+    count(*) FILTER (WHERE status = 'done'),
+    count(*) FILTER (WHERE status = 'dead'),
+    avg(extract(epoch FROM started_at - created_at)),
+    max(extract(epoch FROM coalesce(started_at, CURRENT_TIMESTAMP) - created_at))
+FROM jobs
+WHERE kind = 'chunk'
+  AND upload_id IN (SELECT upload_id FROM jobs WHERE status IN ('queued', 'running'))
+GROUP BY upload_id
+ORDER BY min(created_at)
+"""
+
+# Timed-out jobs without attempts left
+dead_letter_query = """
+UPDATE jobs SET status = 'dead', last_error = coalesce(last_error, 'visibility timeout'), updated_at = CURRENT_TIMESTAMP
+WHERE status = 'running' AND visible_at <= CURRENT_TIMESTAMP AND attempts >= max_attempts
+RETURNING upload_id
+"""
+
+
+def install(cursor):
+    # Create the jobs table, its indexes and the NOTIFY trigger. Run once
+    # with `python job_queue.py setup`, not by workers or the API: the DDL
+    # takes exclusive locks on a busy table.
+    cursor.execute(create_jobs_query)
+
+def enqueue(cursor, kind, upload_id, payload=None, priority=None, deadline=None, sort_key=0):
+    # Add a job; returns its id. Workers are woken by the trigger's NOTIFY.
+    # priority weighs the upload's share of workers, deadline is when it
+    # should be done: a timestamp, or seconds from now. Upload and finalize
+    # jobs keep sort_key 0 and run ahead of chunks, they are cheap.
+    seconds = deadline if isinstance(deadline, (int, float)) else None
+    cursor.execute(
+        "INSERT INTO jobs (kind, upload_id, payload, priority, deadline, sort_key) "
+        "VALUES (%s, %s, %s, %s, coalesce(%s::timestamp, CURRENT_TIMESTAMP + make_interval(secs => %s)), %s) RETURNING id",
+        (kind, upload_id, Json(payload or {}), clamp_priority(priority), None if seconds is not None else deadline, seconds, sort_key)
+    )
+    return cursor.fetchone()[0]
+
+def fail_upload(cursor, upload_id):
+    cursor.execute("UPDATE csv_upload SET status = %s WHERE id = %s", ("failed", upload_id))
+    notify_upload(cursor, upload_id, status="failed")
+
+def active_jobs(cursor, upload_id):
+    # Number of queued or running jobs of an upload
+    cursor.execute("SELECT count(*) FROM jobs WHERE upload_id = %s AND status IN ('queued', 'running')", (upload_id,))
+    return cursor.fetchone()[0]
+
+def supersede(cursor, upload_id):
+    # Retire the finished and dead jobs of an upload before it is resumed,
+    # so its new chunks and finalize job start from a clean slate
+    cursor.execute(
+        "UPDATE jobs SET status = 'superseded', updated_at = CURRENT_TIMESTAMP "
+        "WHERE upload_id = %s AND status IN ('done', 'dead')",
+        (upload_id,)
+    )
+
+def claim(conn, worker_id):
+    # Next due job as (id, kind, upload_id, payload, attempts), or None
+    cursor = conn.cursor()
+    cursor.execute(dead_letter_query)
+    for (upload_id,) in cursor.fetchall():
+        print(f"{upload_id}: a job ran out of attempts, upload failed")
+        fail_upload(cursor, upload_id)
+
+    params = {'worker_id': worker_id, 'timeout': visibility_timeout, 'slack': deadline_slack}
+    cursor.execute(claim_urgent_query, params)
+    job = cursor.fetchone()
+    if job is None:
+        cursor.execute(claim_fair_query, params)
+        job = cursor.fetchone()
+    return job
+
+def complete(conn, job_id, worker_id, result):
+    # False if the job is no longer this worker's: its visibility timeout
+    # passed and another worker claimed it, or it was superseded
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE jobs SET status = 'done', result = %s, last_error = NULL, updated_at = CURRENT_TIMESTAMP "
+        "WHERE id = %s AND locked_by = %s AND status = 'running'",
+        (Json(result), job_id, worker_id)
+    )
+    return cursor.rowcount > 0
+
+def fail(conn, job_id, worker_id, upload_id, attempts, error):
+    # Retry later with a growing delay, or dead-letter the job; nothing
+    # happens if the job is no longer this worker's (see complete)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE jobs SET
+            status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+            visible_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+            last_error = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND locked_by = %s AND status = 'running'
+        RETURNING status
+        """,
+        (retry_delay * attempts, error, job_id, worker_id)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        print(f"Job {job_id} was taken over by another worker, its failure is not recorded")
+        return
+    if row[0] == 'dead':
+        print(f"Job {job_id} dead-lettered after {attempts} attempts")
+        fail_upload(cursor, upload_id)
+
+def run_upload(conn, upload_id, payload, priority, deadline):
+    # Queue one chunk job per row range, in the same transaction as marking
+    # this job done (see run_job). The chunks interleave with those of other
+    # active uploads by their fair queuing tags.
+    prepared = upload_jobs.prepare_upload(upload_id, payload['filename'], payload.get('resume', False))
+    if prepared is None:
+        return {'error': 'Title, body and/or rating columns not found in the CSV file.'}
+
+    columns, chunks = prepared
+    cursor = conn.cursor()
+    cursor.execute(virtual_time_query)
+    tags = chunk_tags(chunks, cursor.fetchone()[0], priority)
+
+    for (start, stop), tag in zip(chunks, tags):
+        enqueue(
+            cursor, 'chunk', upload_id,
+            {'filename': payload['filename'], 'columns': columns, 'start': start, 'stop': stop, 'enqueued_at': time.time()},
+            priority, deadline, tag
+        )
+    if not chunks:
+        enqueue(cursor, 'finalize', upload_id, {'filename': payload['filename']}, priority, deadline)
+    return {'chunks': len(chunks)}
+
+def chunk_done(conn, upload_id, filename):
+    # Queue the finalize job once no chunk of the upload is left. The lock on
+    # the upload job serializes the check between chunks finishing together.
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id FROM jobs WHERE upload_id = %s AND kind = 'upload' AND status <> 'superseded' FOR UPDATE",
+        (upload_id,)
+    )
+    cursor.execute(
+        "SELECT count(*) FROM jobs WHERE upload_id = %s AND kind = 'chunk' AND status IN ('queued', 'running', 'dead')",
+        (upload_id,)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(
+            "INSERT INTO jobs (kind, upload_id, payload, priority, deadline) "
+            "SELECT 'finalize', upload_id, %s, priority, deadline FROM jobs "
+            "WHERE upload_id = %s AND kind = 'upload' AND status <> 'superseded' "
+            "ON CONFLICT DO NOTHING",
+            (Json({'filename': filename}), upload_id)
+        )
+
+def run_finalize(conn, upload_id, payload):
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT result FROM jobs WHERE upload_id = %s AND kind = 'chunk' AND status = 'done' ORDER BY id",
+        (upload_id,)
+    )
+    results = [row[0] for row in cursor.fetchall()]
+    return upload_jobs.finish_upload(results, upload_id, payload['filename'])
+
+def heartbeat(job_id, worker_id, stopped):
+    # Push the visibility timeout out while the job is still running; a
+    # missed beat is retried on the next one
+    while not stopped.wait(visibility_timeout / 3):
+        try:
+            with connection() as conn:
+                conn.cursor().execute(
+                    "UPDATE jobs SET visible_at = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP "
+                    "WHERE id = %s AND locked_by = %s AND status = 'running'",
+                    (visibility_timeout, job_id, worker_id)
+                )
+        except psycopg2.Error as e:
+            print(f"Job {job_id}: heartbeat failed:", e)
+
+def queue_stats(cursor):
+    # Chunk counts and queue wait (enqueue to first claim) of active uploads
+    cursor.execute(queue_stats_query)
+    return [
+        {
+            'upload_id': str(upload_id),
+            'priority': priority,
+            'deadline': deadline.isoformat() if deadline else None,
+            'queued': queued,
+            'running': running,
+            'done': done,
+            'dead': dead,
+            'avg_wait_s': round(float(avg_wait), 2) if avg_wait is not None else None,
+            'max_wait_s': round(float(max_wait), 2) if max_wait is not None else None,
+        }
+        for upload_id, priority, deadline, queued, running, done, dead, avg_wait, max_wait in cursor.fetchall()
+    ]
+
+def run_job(conn, job, worker_id):
+    job_id, kind, upload_id, payload, attempts, priority, deadline = job
+    print(f"Job {job_id}: {kind} of {upload_id} (attempt {attempts}, priority {priority})")
+
+    stopped = threading.Event()
+    threading.Thread(target=heartbeat, args=(job_id, worker_id, stopped), daemon=True).start()
+
+    try:
+        if kind == 'upload':
+            result = run_upload(conn, upload_id, payload, priority, deadline)
+        elif kind == 'chunk':
+            result = upload_jobs.process_chunk(
+                upload_id, payload['filename'], payload['columns'], payload['start'], payload['stop'], payload.get('enqueued_at')
+            )
+        elif kind == 'finalize':
+            result = run_finalize(conn, upload_id, payload)
+        else:
+            raise ValueError(f'Unknown job kind {kind}')
+    except Exception as e:
+        traceback.print_exc()
+        conn.rollback()
+        fail(conn, job_id, worker_id, upload_id, attempts, str(e))
+        conn.commit()
+        return
+    finally:
+        stopped.set()
+
+    # A job that was claimed again meanwhile belongs to the other worker;
+    # drop this run's result, including the chunks run_upload queued
+    if not complete(conn, job_id, worker_id, result):
+        print(f"Job {job_id} was taken over by another worker, result dropped")
+        conn.rollback()
+        return
+    if kind == 'chunk':
+        chunk_done(conn, upload_id, payload['filename'])
+    conn.commit()
+
+def serve(conn, worker_id, wakeup):
+    # Claim and run jobs on one connection until it fails, with one
+    # transaction per claim and per job result
+    conn.autocommit = False
+    try:
+        while True:
+            wakeup.clear()
+            job = claim(conn, worker_id)
+            conn.commit()
+
+            if job is None:
+                wakeup.wait(idle_poll)
+                continue
+
+            run_job(conn, job, worker_id)
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            conn.autocommit = True
+
+def work(worker_id=None):
+    # Claim and run jobs until interrupted; sleeps until a NOTIFY when idle.
+    # When the database goes away the worker takes a fresh pooled connection
+    # and carries on; a job it was running is claimed again once its
+    # visibility timeout passes.
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    wakeup = threading.Event()
+
+    listener = NotificationListener([channel], lambda name, payload: wakeup.set(), on_reconnect=wakeup.set)
+    listener.start()
+
+    while True:
+        try:
+            with connection() as conn:
+                serve(conn, worker_id, wakeup)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"Worker {worker_id} lost its database connection, reconnecting in {reconnect_delay}s:", e)
+            time.sleep(reconnect_delay)
+
+def supervise(processes):
+    # Run worker processes, replacing any that exits
+    workers = []
+    for _ in range(processes):
+        workers.append(multiprocessing.Process(target=work))
+        workers[-1].start()
+
+    while True:
+        multiprocessing.connection.wait([worker.sentinel for worker in workers])
+        for index, worker in enumerate(workers):
+            if not worker.is_alive():
+                print(f"Worker process {worker.pid} exited with code {worker.exitcode}, starting another")
+                workers[index] = multiprocessing.Process(target=work)
+                workers[index].start()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == 'setup':
+        with connection() as conn:
+            install(conn.cursor())
+        print('Jobs table, indexes and trigger installed')
+        sys.exit(0)
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'worker':
+        print("Usage: python job_queue.py setup | worker [processes]")
+        sys.exit(1)
+
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    if processes == 1:
+        work()
+    else:
+        supervise(processes)
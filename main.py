@@ -2,8 +2,7 @@ import os
 import csv
 import psycopg2
 import traceback
-import time
-from openai.error import RateLimitError
+from rate_limiter import call_with_limits, estimate_tokens
 
 from langchain import OpenAI, LLMChain
 from langchain.chat_models import ChatOpenAI
@@ -26,20 +25,8 @@ db_password = 'root1234'
 chat_llm = ChatOpenAI()
 
 def completion_with_retry(prompt):
-    retry_delay = 1.0
-    max_retries = 3
-    retries = 0
-
-    while True:
-        try:
-            return chat_llm.completion(prompt)
-        except RateLimitError as e:
-            if retries >= max_retries:
-                raise e
-            else:
-                retries += 1
-                print(f"Rate limit exceeded. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+    # Shared request/token limiter with exponential backoff, see rate_limiter.py
+    return call_with_limits(lambda: chat_llm.completion(prompt), estimate_tokens(str(prompt)))
 
 
 guidelines_prompt = '''
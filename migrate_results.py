@@ -0,0 +1,106 @@
+import sys
+
+from db import connection
+from results_table import ensure_results_table, result_values
+
+# Folds the old one-table-per-upload results ("<upload uuid>" tables) into
+# review_results. Each table is copied in its own transaction; with --drop
+# it is dropped in the same transaction once its rows are in.
+#
+#   python migrate_results.py [--drop] [--dry-run]
+
+legacy_tables_query = """
+SELECT table_name
+FROM information_schema.tables
+WHERE table_schema = 'public'
+  AND table_type = 'BASE TABLE'
+  AND table_name ~ '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+ORDER BY table_name
+"""
+
+# Same mapping as status_value / result_value in results_table.py. The old
+# SERIAL id becomes row_no, which keeps the insert (file) order.
+copy_query = """
+INSERT INTO review_results (upload_id, row_no, review, status, reason, result, source, created_at)
+SELECT
+    %(upload_id)s,
+    id,
+    tbody,
+    CASE
+        WHEN status ILIKE '%%violat%%' THEN 'Violation'
+        WHEN status ILIKE '%%compliant%%' THEN 'Compliant'
+        ELSE 'N/A'
+    END::review_status,
+    reason,
+    CASE
+        WHEN lower(result) = ANY(%(result_values)s) THEN lower(result)
+        ELSE 'n/a'
+    END::review_result,
+    {source},
+    COALESCE(timestamp_column, CURRENT_TIMESTAMP)
+FROM "{table}"
+ON CONFLICT (upload_id, row_no) DO NOTHING
+"""
+
+
+def has_source_column(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'source'",
+        (table,)
+    )
+    return cursor.fetchone() is not None
+
+def migrate_table(conn, table, drop=False):
+    cursor = conn.cursor()
+    # Tables from before the source column existed
+    source = 'source' if has_source_column(cursor, table) else 'NULL'
+
+    cursor.execute(
+        copy_query.format(table=table, source=source),
+        {'upload_id': table, 'result_values': list(result_values)}
+    )
+    copied = cursor.rowcount
+
+    if drop:
+        cursor.execute(f'DROP TABLE "{table}"')
+
+    conn.commit()
+    return copied
+
+def main(argv):
+    drop = '--drop' in argv
+    dry_run = '--dry-run' in argv
+
+    with connection() as conn:
+        cursor = conn.cursor()
+        ensure_results_table(cursor)
+
+        cursor.execute(legacy_tables_query)
+        tables = [row[0] for row in cursor.fetchall()]
+        print(f"{len(tables)} per-upload result tables found")
+
+        if dry_run:
+            for table in tables:
+                print(table)
+            return
+
+        # One transaction per table, so a failure leaves the others done
+        conn.autocommit = False
+        try:
+            total = 0
+            for table in tables:
+                try:
+                    copied = migrate_table(conn, table, drop)
+                except Exception as e:
+                    conn.rollback()
+                    print(f'Error migrating "{table}":', e)
+                    continue
+                total += copied
+                print(f'"{table}": {copied} rows' + (' (dropped)' if drop else ''))
+            print(f"{total} rows migrated into review_results")
+        finally:
+            conn.autocommit = True
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+import os
+import re
+import zlib
+import random
+from array import array
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Jaccard similarity above which two reviews are treated as the same review
+similarity_threshold = float(os.getenv('NEAR_DUPE_THRESHOLD', '0.9'))
+# Upper bound on reviews kept in the index, per process; the oldest are
+# evicted first. An entry takes about 1 KB (see NearDuplicateIndex), so the
+# default is about 100 MB per worker process.
+max_reviews = int(os.getenv('NEAR_DUPE_MAX_REVIEWS', '100000'))
+
+# 8 bands of 8 rows: a pair at the 0.9 threshold still shares a band with
+# probability 0.99, at half the bucket entries of 16 bands of 4
+num_perm = 64
+bands = 8
+rows_per_band = num_perm // bands
+shingle_size = 3
+
+mersenne_prime = (1 << 61) - 1
+max_hash = (1 << 32) - 1
+
+# Fixed seed so signatures are comparable across processes
+rng = random.Random(4)
+permutations = [
+    (rng.randrange(1, mersenne_prime), rng.randrange(0, mersenne_prime))
+    for _ in range(num_perm)
+]
+
+
+def shingles(review):
+    # Word 3-grams of the review with punctuation and case removed
+    words = re.findall(r'\w+', review.lower())
+    if len(words) < shingle_size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+
+def minhash(review):
+    # Stored as a packed array of 32-bit values to keep the index small
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles(review)]
+    return array('I', (
+        min(((a * h + b) % mersenne_prime) & max_hash for h in hashes)
+        for a, b in permutations
+    ))
+
+
+def similarity(sig1, sig2):
+    # Estimated Jaccard similarity of the two reviews' shingle sets
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / num_perm
+
+
+class NearDuplicateIndex:
+    # MinHash LSH over classified reviews. Reviews that differ only in
+    # punctuation, case or a repeated title collide in at least one band and
+    # can reuse the stored verdict instead of going to the model.
+    #
+    # Entries live in a ring of `capacity` slots: all signatures in one
+    # packed array (256 bytes each), one verdict reference per slot with
+    # equal verdicts interned, and per band a dict from an integer band key
+    # to the entry id (a list only when keys collide). About 1 KB per entry
+    # in total, most of it the 8 band dict entries.
+
+    def __init__(self, threshold=None, capacity=None):
+        self.threshold = similarity_threshold if threshold is None else threshold
+        self.capacity = max_reviews if capacity is None else capacity
+        self.signatures = array('I')
+        self.verdicts = []
+        self.interned = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.saved_calls = 0
+        self.lookups = 0
+
+    def band_keys(self, signature):
+        return [
+            hash(signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+            for band in range(bands)
+        ]
+
+    def signature(self, entry_id):
+        slot = entry_id % self.capacity
+        return self.signatures[slot * num_perm:(slot + 1) * num_perm]
+
+    def intern(self, verdict):
+        # Most verdicts repeat; keep one tuple per distinct verdict. The
+        # table is bounded too, dropping it only stops sharing new copies.
+        if len(self.interned) > self.capacity:
+            self.interned.clear()
+        return self.interned.setdefault(verdict, verdict)
+
+    def add(self, review, verdict):
+        signature = minhash(review)
+
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            slot = entry_id % self.capacity
+
+            if entry_id >= self.capacity:
+                # The ring is full, this slot holds the oldest entry
+                self.evict(entry_id - self.capacity)
+                self.signatures[slot * num_perm:(slot + 1) * num_perm] = signature
+                self.verdicts[slot] = self.intern(verdict)
+            else:
+                self.signatures.extend(signature)
+                self.verdicts.append(self.intern(verdict))
+
+            for band, key in enumerate(self.band_keys(signature)):
+                ids = self.buckets[band].get(key)
+                if ids is None:
+                    self.buckets[band][key] = entry_id
+                elif isinstance(ids, list):
+                    ids.append(entry_id)
+                else:
+                    self.buckets[band][key] = [ids, entry_id]
+
+    def evict(self, old_id):
+        for band, key in enumerate(self.band_keys(self.signature(old_id))):
+            ids = self.buckets[band].get(key)
+            if ids == old_id:
+                del self.buckets[band][key]
+            elif isinstance(ids, list):
+                ids.remove(old_id)
+                if len(ids) == 1:
+                    self.buckets[band][key] = ids[0]
+
+    def find(self, review):
+        # Verdict of the most similar indexed review above the threshold, or None
+        signature = minhash(review)
+
+        with self.lock:
+            self.lookups += 1
+            candidates = set()
+            for band, key in enumerate(self.band_keys(signature)):
+                ids = self.buckets[band].get(key)
+                if isinstance(ids, list):
+                    candidates.update(ids)
+                elif ids is not None:
+                    candidates.add(ids)
+
+            best = None
+            best_score = self.threshold
+            for entry_id in candidates:
+                score = similarity(signature, self.signature(entry_id))
+                if score >= best_score:
+                    best = self.verdicts[entry_id % self.capacity]
+                    best_score = score
+
+            if best is not None:
+                self.saved_calls += 1
+
+            return best
+
+    def stats(self):
+        with self.lock:
+            return {
+                'reviews': len(self.verdicts),
+                'lookups': self.lookups,
+                'saved_calls': self.saved_calls,
+            }
+
@@ -0,0 +1,65 @@
+import time
+import select
+import threading
+
+import psycopg2
+
+from db import connect
+
+# How long one wait for notifications lasts, and the pause before reconnecting
+poll_timeout = 5  # seconds
+reconnect_delay = 5  # seconds
+
+
+class NotificationListener(threading.Thread):
+    # Background thread that LISTENs on Postgres channels and calls
+    # handle(channel, payload) for every NOTIFY. On a dropped connection it
+    # reconnects and calls on_reconnect(), since notifications sent in
+    # between are lost.
+
+    def __init__(self, channels, handle, on_reconnect=None):
+        super().__init__(daemon=True, name='notify-listener')
+        self.channels = list(channels)
+        self.handle = handle
+        self.on_reconnect = on_reconnect
+        self.stopped = threading.Event()
+        self.connected = threading.Event()
+
+    def listen(self):
+        conn = connect()
+        cursor = conn.cursor()
+        for channel in self.channels:
+            cursor.execute(f'LISTEN "{channel}"')
+        self.connected.set()
+        return conn
+
+    def run(self):
+        first = True
+        while not self.stopped.is_set():
+            conn = None
+            try:
+                conn = self.listen()
+                if not first and self.on_reconnect is not None:
+                    self.on_reconnect()
+                first = False
+
+                while not self.stopped.is_set():
+                    # Wait until the connection has something to read
+                    if select.select([conn], [], [], poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.handle(notify.channel, notify.payload)
+
+            except psycopg2.Error as e:
+                print('Notification listener lost its connection:', e)
+                self.connected.clear()
+                first = False
+                time.sleep(reconnect_delay)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def stop(self):
+        self.stopped.set()
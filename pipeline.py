@@ -0,0 +1,150 @@
+from classifier import ReviewClassifier, batch_size, estimate_tokens, make_batches
+from dispatch import dispatch_reviews, dispatch_batches, parse_answer, format_answer, normalize_result
+from example_index import SimilarExamplePrompts, few_shot_mode, get_example_index
+from guideline_pruning import PrunedPrompts, pruning_enabled
+from near_dupes import NearDuplicateIndex
+from prompt_cache import prompt_cache
+from triage import triage, triage_enabled
+from verdict_cache import VerdictCache
+
+# Near-duplicate index of classified reviews, shared by the jobs of this
+# process and rebuilt whenever the prompt version changes
+near_dupe_indexes = {}
+
+def get_near_dupe_index(version):
+    if version not in near_dupe_indexes:
+        near_dupe_indexes.clear()
+        near_dupe_indexes[version] = NearDuplicateIndex()
+    return near_dupe_indexes[version]
+
+
+class ReviewPipeline:
+    # Everything one job needs to turn (i, review, needs_llm) items into
+    # verdicts: the classifier with its prompt, triage rules, the verdict
+    # cache and the near-duplicate index. Built once per job.
+
+    def __init__(self, conn):
+        cursor = conn.cursor()
+
+        # Examples and rendered prompt, cached until tune_data4 changes
+        fine_tune, self.guidelines_prompt = prompt_cache.fine_tune(cursor)
+
+        # Build the prompt prefix, client and chain once for the whole job
+        if few_shot_mode == 'similar':
+            # The most similar labelled reviews as examples for each review
+            example_index = get_example_index(cursor)
+            prompts = SimilarExamplePrompts(example_index, pruned=pruning_enabled)
+            variant = '+similar:' + example_index.version[:16]
+        elif pruning_enabled:
+            # Only the guideline sections each review plausibly touches
+            prompts = PrunedPrompts(fine_tune)
+            variant = ''
+        else:
+            prompts = None
+            variant = ''
+
+        if pruning_enabled:
+            variant += '+pruned'
+
+        self.classifier = ReviewClassifier(self.guidelines_prompt, prompts=prompts)
+        self.model_variant = self.classifier.chat_llm.model_name + variant
+
+        # Reviews already judged with this prompt and model are not sent again
+        self.verdict_cache = VerdictCache(conn, self.guidelines_prompt, self.model_variant)
+        self.near_dupes = get_near_dupe_index(self.verdict_cache.version)
+
+        # Where each verdict came from: rule (triage), cache, near_duplicate or model
+        self.sources = {}
+
+    def lookup(self, review):
+        # (answer, source) when the review can be judged without the model:
+        # by the triage rules, the verdict cache or a near twin. Else None.
+        if triage_enabled:
+            verdict = triage(review)
+            if verdict is not None:
+                return format_answer(*verdict), 'rule'
+
+        cached = self.verdict_cache.get_answer(review)
+        if cached is not None:
+            return cached, 'cache'
+
+        verdict = self.near_dupes.find(review)
+        if verdict is not None:
+            return format_answer(*verdict), 'near_duplicate'
+
+        return None
+
+    def remember(self, review, answer):
+        self.near_dupes.add(review, parse_answer(answer))
+
+    def classify(self, item):
+        i, review, needs_llm = item
+
+        if not needs_llm:
+            return None
+
+        cached = self.lookup(review)
+        if cached is not None:
+            return cached
+
+        answer = self.classifier.run(review)
+        self.remember(review, answer)
+        return answer, 'model'
+
+    def classify_batch(self, batch):
+        # One prompt for all uncached 1-3 star reviews in the batch, None for the rest
+        answers = {}
+        pending = []
+
+        for i, review, needs_llm in batch:
+            if needs_llm:
+                answers[i] = self.lookup(review)
+                if answers[i] is None:
+                    pending.append((i, review))
+
+        batch_answers = self.classifier.run_batch([review for i, review in pending])
+        for (i, review), answer in zip(pending, batch_answers):
+            self.remember(review, answer)
+            answers[i] = answer, 'model'
+
+        return [answers.get(i) for i, review, needs_llm in batch]
+
+    def answers(self, items):
+        # Classify the 1-3 star reviews concurrently, results come back in file
+        # order as ((i, review, needs_llm), (answer, source) or None)
+        if batch_size > 1:
+            batches = make_batches(
+                items,
+                weight=lambda item: estimate_tokens(item[1]) if item[2] else None
+            )
+            return dispatch_batches(batches, self.classify_batch)
+
+        return dispatch_reviews(items, self.classify)
+
+    def verdict(self, review, answer, source):
+        # (status, reason, result) to store for a classified review; the
+        # result is one of no, yes, maybe or N/A
+        self.sources[source] = self.sources.get(source, 0) + 1
+        status, reason, result = parse_answer(answer)
+
+        print("Review:", review)
+        print("Reason:", reason)
+        print("Status:", status)
+        print("Result:", result + '\n')
+        print("Source:", source)
+
+        result = normalize_result(result)
+
+        if source == 'model':
+            self.verdict_cache.put(review, status, reason, result.lower())
+
+        return status, reason, result
+
+    def print_stats(self, total):
+        print("Prompt cache:", prompt_cache.stats())
+        print("Verdict cache:", self.verdict_cache.stats())
+        print("Near duplicates:", self.near_dupes.stats())
+        print("Verdict sources:", self.sources)
+        if total:
+            avoided = total - self.sources.get('model', 0)
+            print(f"LLM calls avoided: {avoided}/{total} ({avoided / total:.0%})")
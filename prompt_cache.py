@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+
+from dotenv import load_dotenv
+
+from few_shot import load_fine_tune_examples, render_guidelines
+from notify_listener import NotificationListener
+
+load_dotenv()
+
+# Changes to tune_data4 and guidelines_prompt are announced on this channel
+# by the triggers below; every process listening drops its cached prompts.
+channel = 'prompt_cache'
+listen_enabled = os.getenv('PROMPT_CACHE_LISTEN', '1') == '1'
+# Safety net if a notification is missed or listening is disabled
+cache_ttl = float(os.getenv('PROMPT_CACHE_TTL', '300'))  # seconds
+
+create_triggers_query = f"""
+CREATE OR REPLACE FUNCTION notify_prompt_cache() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tune_data4_prompt_cache ON tune_data4;
+CREATE TRIGGER tune_data4_prompt_cache
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tune_data4
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_prompt_cache();
+
+DROP TRIGGER IF EXISTS guidelines_prompt_prompt_cache ON guidelines_prompt;
+CREATE TRIGGER guidelines_prompt_prompt_cache
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON guidelines_prompt
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_prompt_cache();
+"""
+
+
+def install_triggers(cursor):
+    # One-off setup: python prompt_cache.py
+    cursor.execute(create_triggers_query)
+
+
+class PromptCache:
+    # Rendered few-shot prompt prefix and guidelines_prompt rows, kept for
+    # the life of the process and dropped when the tables change. Each table
+    # has a version that goes up on every change, so dependants such as the
+    # example index know when to refresh.
+
+    def __init__(self, ttl=None):
+        self.ttl = cache_ttl if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.versions = {'tune_data4': 0, 'guidelines_prompt': 0}
+        self.listener = None
+        self.listener_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, table=None):
+        # Drop the entries built from table, or everything
+        with self.lock:
+            for name in ([table] if table else list(self.versions)):
+                self.versions[name] = self.versions.get(name, 0) + 1
+                for key in [key for key in self.entries if key[0] == name]:
+                    del self.entries[key]
+        print('Prompt cache invalidated:', table or 'all')
+
+    def version(self, table):
+        self.ensure_listener()
+        with self.lock:
+            return self.versions.get(table, 0)
+
+    def ensure_listener(self):
+        # Start the listener thread lazily, and again in forked workers
+        # (Celery prefork), where the parent's thread does not exist
+        if not listen_enabled:
+            return
+        with self.lock:
+            if self.listener is not None and self.listener_pid == os.getpid() and self.listener.is_alive():
+                return
+            self.listener = NotificationListener(
+                [channel],
+                lambda name, payload: self.invalidate(payload or None),
+                on_reconnect=self.invalidate
+            )
+            self.listener_pid = os.getpid()
+            self.listener.start()
+
+        # Entries cached before the listener was up could already be stale
+        self.listener.connected.wait(timeout=2)
+
+    def get(self, key, load):
+        # Cached value for key, built with load() on a miss. key[0] names
+        # the table the value is built from.
+        self.ensure_listener()
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            version = self.versions.get(key[0], 0)
+
+        value = load()
+
+        with self.lock:
+            self.misses += 1
+            # Skip storing if the table changed while loading
+            if self.versions.get(key[0], 0) == version:
+                self.entries[key] = (now, value)
+        return value
+
+    def fine_tune(self, cursor):
+        # (fine_tune examples, rendered guidelines prompt)
+        def load():
+            fine_tune = load_fine_tune_examples(cursor)
+            return fine_tune, render_guidelines(fine_tune)
+
+        return self.get(('tune_data4', 'prompt'), load)
+
+    def guidelines(self, cursor, guidelines_id):
+        # guidelines text of a guidelines_prompt row
+        def load():
+            cursor.execute("SELECT guidelines FROM guidelines_prompt WHERE id = %s;", (guidelines_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        return self.get(('guidelines_prompt', guidelines_id), load)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'versions': dict(self.versions)}
+
+
+prompt_cache = PromptCache()
+
+
+if __name__ == '__main__':
+    from db import connection
+
+    with connection() as conn:
+        install_triggers(conn.cursor())
+    print('Prompt cache triggers installed on tune_data4 and guidelines_prompt')
@@ -1,48 +1,34 @@
-import os
-import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from dotenv import load_dotenv
+from notify_listener import NotificationListener
+from job_queue import channel as jobs_channel
+from prompt_cache import channel as prompt_cache_channel
 
-load_dotenv()
-
-# Retrieve the PostgreSQL connection details from environment variables
-db_host = os.getenv('HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DATABASE')
-db_user = os.getenv('USER')
-db_password = os.getenv('PASSWORD')
-
-# Connect to the PostgreSQL database
-conn = psycopg2.connect(
-    host=db_host,
-    port=db_port,
-    database=db_name,
-    user=db_user,
-    password=db_password
-)
-
-# Set the isolation level to autocommit
-conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-
-# Create a new cursor
-cur = conn.cursor()
+# Prints the notifications the app's triggers send. The same listener runs
+# inside the API and workers to invalidate their prompt cache (prompt_cache.py).
 
 # Define a function to handle the trigger event
 def notify_csv_upload_trigger():
     # Add your logic here to handle the trigger event
     print("Trigger event received!")
 
-# Enable listening for notifications
-cur.execute("LISTEN csv_upload_channel")
-
-# Loop to listen for notifications
-while True:
-    conn.poll()
-    while conn.notifies:
-        notify = conn.notifies.pop(0)
-        print("Received notification on channel:", notify.channel)
-        # Perform actions based on the received notification
-        if notify.channel == 'csv_upload_channel':
-            notify_csv_upload_trigger()
-
-    # Add any other processing or wait mechanism as needed
+def handle(channel, payload):
+    print("Received notification on channel:", channel)
+    # Perform actions based on the received notification
+    if channel == 'csv_upload_channel':
+        notify_csv_upload_trigger()
+    elif channel == jobs_channel:
+        print("Job queued:", payload)
+    elif channel == prompt_cache_channel:
+        print("Prompt cache invalidated by a change to", payload)
+
+def reconnected():
+    print("Listener reconnected, notifications sent meanwhile were missed")
+
+
+if __name__ == '__main__':
+    # Listen for notifications until interrupted
+    listener = NotificationListener(['csv_upload_channel', jobs_channel, prompt_cache_channel], handle, on_reconnect=reconnected)
+    listener.start()
+    try:
+        listener.join()
+    except KeyboardInterrupt:
+        listener.stop()
@@ -0,0 +1,93 @@
+import time
+import threading
+
+from psycopg2 import errors
+
+from results_table import summary_columns
+
+# The API's hot queries as server-side prepared statements. Each pooled
+# connection prepares a statement the first time it runs it and reuses the
+# plan afterwards, so a /status poll is only EXECUTE round trips.
+statements = {
+    'insert_upload': "INSERT INTO csv_upload (filename, status) VALUES ($1, $2) RETURNING id",
+    'upload_status': "SELECT status FROM csv_upload WHERE id = $1",
+    'upload_filename': "SELECT filename FROM csv_upload WHERE id = $1",
+    'set_upload_status': "UPDATE csv_upload SET status = $2 WHERE id = $1",
+    # Handing an upload to the workers counts as progress for reaper.py
+    'start_processing': "UPDATE csv_upload SET status = 'processing', last_progress_at = CURRENT_TIMESTAMP WHERE id = $1",
+    'resume_processing': (
+        "UPDATE csv_upload SET status = 'processing', last_progress_at = CURRENT_TIMESTAMP, resume_count = resume_count + 1 "
+        "WHERE id = $1"
+    ),
+    'set_upload_job': "UPDATE csv_upload SET job_id = $2 WHERE id = $1",
+    'upload_job': (
+        "SELECT job_id, status, extract(epoch FROM CURRENT_TIMESTAMP - last_progress_at) FROM csv_upload WHERE id = $1"
+    ),
+    'upload_summary': f"SELECT status, {', '.join(summary_columns)} FROM csv_upload WHERE id = $1",
+    'upload_checkpoints': "SELECT row_checkpoints FROM csv_upload WHERE id = $1",
+}
+
+# Statements prepared per connection: {id(conn): (conn, {names})}
+prepared = {}
+prepared_lock = threading.Lock()
+
+# Per-statement latency: {name: [calls, total seconds, max seconds]}
+latency = {}
+latency_lock = threading.Lock()
+
+
+def prepared_names(conn):
+    with prepared_lock:
+        entry = prepared.get(id(conn))
+        if entry is None or entry[0] is not conn:
+            # Forget connections the pool has closed since
+            for key in [key for key, (other, names) in prepared.items() if other.closed]:
+                del prepared[key]
+            entry = prepared[id(conn)] = (conn, set())
+        return entry[1]
+
+def record(name, elapsed):
+    with latency_lock:
+        calls = latency.setdefault(name, [0, 0.0, 0.0])
+        calls[0] += 1
+        calls[1] += elapsed
+        calls[2] = max(calls[2], elapsed)
+
+def execute(conn, name, *params):
+    # Run a statement by name and return its cursor
+    start = time.monotonic()
+    cursor = conn.cursor()
+    names = prepared_names(conn)
+
+    if name not in names:
+        cursor.execute(f"PREPARE {name} AS {statements[name]}")
+        names.add(name)
+
+    placeholders = ', '.join(['%s'] * len(params))
+    query = f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}"
+    try:
+        cursor.execute(query, params)
+    except errors.InvalidSqlStatementName:
+        # The session lost its prepared statements (e.g. DISCARD ALL)
+        names.clear()
+        cursor.execute(f"PREPARE {name} AS {statements[name]}")
+        names.add(name)
+        cursor.execute(query, params)
+
+    record(name, time.monotonic() - start)
+    return cursor
+
+def fetchone(conn, name, *params):
+    return execute(conn, name, *params).fetchone()
+
+def stats():
+    # {name: {calls, avg_ms, max_ms}} since the process started
+    with latency_lock:
+        return {
+            name: {
+                'calls': calls,
+                'avg_ms': round(total / calls * 1000, 2),
+                'max_ms': round(worst * 1000, 2),
+            }
+            for name, (calls, total, worst) in latency.items()
+        }
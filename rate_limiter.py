@@ -0,0 +1,186 @@
+import os
+import time
+import random
+import threading
+
+from openai.error import APIConnectionError, APIError, RateLimitError, ServiceUnavailableError, Timeout
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+load_dotenv()
+
+# Account quota, keep these a little under the real limits
+requests_per_minute = int(os.getenv('OPENAI_RPM', '3500'))
+tokens_per_minute = int(os.getenv('OPENAI_TPM', '90000'))
+
+# Redis that shares the buckets between threads, worker processes and hosts;
+# the Celery broker unless set
+redis_url = os.getenv('RATE_LIMIT_REDIS_URL') or os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+# Without Redis every process keeps its own buckets, so each one gets this
+# share of the quota: set it to the number of worker processes on all hosts
+local_share = int(os.getenv('RATE_LIMIT_WORKERS', '1'))
+
+# Errors worth another try: 429s and the transient server and network
+# errors the OpenAI client would otherwise retry itself
+retry_errors = (RateLimitError, Timeout, APIConnectionError, ServiceUnavailableError, APIError)
+
+# Backoff after a retryable error: exponential with full jitter, capped per call
+max_retries = int(os.getenv('OPENAI_MAX_RETRIES', '6'))
+base_delay = 1.0  # seconds
+max_delay = 60.0  # seconds
+
+
+def estimate_tokens(text):
+    # Rough count (about 4 characters per token), good enough for budgeting
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    # Refills continuously at `rate` per minute up to `rate`
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.level = float(rate)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.rate
+
+
+class LocalRateLimiter:
+    # Request and token buckets shared by the threads of one process
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm or requests_per_minute)
+        self.tokens = TokenBucket(tpm or tokens_per_minute)
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.tokens.rate)
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait == 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= tokens
+                    return
+
+            time.sleep(wait)
+
+
+# Both buckets are checked and taken atomically; Redis' own clock is used so
+# workers on different hosts agree. Returns the seconds to wait, 0 if taken.
+acquire_script = '''
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+    local rate = tonumber(ARGV[i])
+    local need = tonumber(ARGV[i + 2])
+    local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(state[1]) or rate
+    local ts = tonumber(state[2]) or now
+    level = math.min(rate, level + (now - ts) * rate / 60)
+    levels[i] = level
+    if level < need then
+        wait = math.max(wait, (need - level) * 60 / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, 2 do
+    redis.call('HSET', KEYS[i], 'level', tostring(levels[i] - tonumber(ARGV[i + 2])), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return '0'
+'''
+
+
+class RedisRateLimiter:
+    # Same buckets as LocalRateLimiter, kept in Redis for all workers
+
+    def __init__(self, client, rpm=None, tpm=None, prefix='openai_rate'):
+        self.client = client
+        self.rpm = rpm or requests_per_minute
+        self.tpm = tpm or tokens_per_minute
+        self.keys = [f'{prefix}:requests', f'{prefix}:tokens']
+        self.script = client.register_script(acquire_script)
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.tpm)
+
+        while True:
+            wait = float(self.script(keys=self.keys, args=[self.rpm, self.tpm, 1, tokens]))
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+limiter = None
+limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    # Process-wide limiter; Redis-backed when configured and reachable
+    global limiter
+
+    with limiter_lock:
+        if limiter is None:
+            if redis_url and redis is not None:
+                try:
+                    client = redis.Redis.from_url(redis_url)
+                    client.ping()
+                    limiter = RedisRateLimiter(client)
+                    print('Rate limiter using Redis at', redis_url)
+                except (redis.RedisError, ValueError) as e:
+                    print('Redis unavailable for rate limiting:', e)
+            if limiter is None:
+                print(
+                    f"WARNING: rate limits are per process, not shared. Each process gets 1/{local_share} "
+                    f"of the quota (RATE_LIMIT_WORKERS); with more worker processes than that they will "
+                    f"exceed it together."
+                )
+                limiter = LocalRateLimiter(
+                    max(1, requests_per_minute // local_share), max(1, tokens_per_minute // local_share)
+                )
+
+        return limiter
+
+
+def call_with_limits(call, tokens=1, retries=None):
+    # Wait for request and token budget, then call(). Rate limits and
+    # transient API errors are retried with exponential backoff and jitter
+    # until the retry budget is spent.
+    if retries is None:
+        retries = max_retries
+
+    attempt = 0
+
+    while True:
+        get_limiter().acquire(tokens)
+        try:
+            return call()
+        except retry_errors as e:
+            if attempt >= retries:
+                raise e
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            attempt += 1
+            print(f"{type(e).__name__}: {e}. Retrying in {delay:.1f} seconds ({attempt}/{retries})...")
+            time.sleep(delay)
@@ -1,10 +1,18 @@
 import os
 import csv
 import time
+import hashlib
+import threading
 import psycopg2
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
 load_dotenv()
 
 # Retrieve the PostgreSQL connection details from environment variables
@@ -14,90 +22,185 @@ db_name = os.getenv('DATABASE')
 db_user = os.getenv('USER')
 db_password = os.getenv('PASSWORD')
 
-# Connect to the PostgreSQL database
-conn = psycopg2.connect(
-    host=db_host,
-    port=db_port,
-    database=db_name,
-    user=db_user,
-    password=db_password
+# Files loaded at the same time, and files waiting for a worker at most
+workers = int(os.getenv('CSV_WORKERS', '4'))
+max_pending = int(os.getenv('CSV_MAX_PENDING', '16'))
+# Polling fallback: seconds between directory scans, and how long a file's
+# size and mtime must stay the same before it is considered fully written
+poll_interval = float(os.getenv('CSV_POLL_INTERVAL', '30'))
+settle_time = float(os.getenv('CSV_SETTLE_SECONDS', '5'))
+
+# Files are identified by content, so a renamed or re-copied file is not
+# loaded again
+create_state_query = """
+CREATE TABLE IF NOT EXISTS csv_ingest (
+    content_hash CHAR(64) PRIMARY KEY,
+    file_name VARCHAR NOT NULL,
+    table_name VARCHAR NOT NULL,
+    row_count INTEGER,
+    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 )
-
-# Function to detect the number of columns in a CSV file
-def detect_column_count(file_path):
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
-        first_row = next(reader)
-        return len(first_row)
-
-# Function to read CSV files from a directory and create a PostgreSQL table for each file
-def read_csv_files(directory):
+"""
+
+local = threading.local()
+
+
+def connect():
+    # One connection per worker thread
+    if getattr(local, 'conn', None) is None or local.conn.closed:
+        local.conn = psycopg2.connect(
+            host=db_host,
+            port=db_port,
+            database=db_name,
+            user=db_user,
+            password=db_password
+        )
+    return local.conn
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_csv(file_path):
+    # Create the file's table and COPY the rows into it, in one transaction
+    # with its csv_ingest row. Returns the row count, or None if a file with
+    # the same content was loaded before.
+    file_name = os.path.basename(file_path)
+    content_hash = file_hash(file_path)
+
+    # Extract the table name from the file name (excluding the extension)
+    table_name = os.path.splitext(file_name)[0]
+
+    conn = connect()
     cursor = conn.cursor()
+    try:
+        # Claim the content first; a concurrent load of the same content
+        # waits here and then finds the row
+        cursor.execute(
+            "INSERT INTO csv_ingest (content_hash, file_name, table_name) VALUES (%s, %s, %s) "
+            "ON CONFLICT (content_hash) DO NOTHING RETURNING content_hash",
+            (content_hash, file_name, table_name)
+        )
+        if cursor.fetchone() is None:
+            conn.rollback()
+            return None
+
+        with open(file_path, 'r', newline='') as csv_file:
+            header_row = next(csv.reader(csv_file))  # Get the header row
 
-    # Create a file to store the names of the files that have been read
-    output_file_path = "files_read.txt"
-    processed_files = set()
-
-    if os.path.exists(output_file_path):
-        with open(output_file_path, "r") as output_file:
-            processed_files = set(output_file.read().splitlines())
-
+            # Create the PostgreSQL table if it doesn't exist
+            columns = ', '.join(f'"{column_name}" VARCHAR' for column_name in header_row)
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({columns});')
+
+            csv_file.seek(0)
+            cursor.copy_expert(f'COPY "{table_name}" FROM STDIN WITH (FORMAT csv, HEADER true)', csv_file)
+            row_count = cursor.rowcount
+
+        cursor.execute(
+            "UPDATE csv_ingest SET row_count = %s WHERE content_hash = %s",
+            (row_count, content_hash)
+        )
+        conn.commit()
+        return row_count
+    except Exception:
+        conn.rollback()
+        raise
+
+def ingest(file_path):
+    try:
+        row_count = load_csv(file_path)
+    except (OSError, StopIteration, psycopg2.Error) as e:
+        print(f"{file_path} could not be loaded:", e)
+        return
+
+    if row_count is None:
+        print(os.path.basename(file_path), "was loaded before, skipped")
+    else:
+        print(os.path.basename(file_path), f"has been processed! ({row_count} rows)")
+
+def watch_inotify(directory):
+    # Paths of CSV files once they are closed after writing or moved into
+    # the directory. Raises OSError where inotify is not available.
+    inotify = INotify()
+    inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def events():
+        while True:
+            for event in inotify.read():
+                if event.name.endswith('.csv'):
+                    yield os.path.join(directory, event.name)
+
+    return events()
+
+def watch_polling(directory):
+    # Yield paths of CSV files whose size and mtime have not changed for
+    # settle_time seconds. Each version of a file is yielded once.
+    seen = {}
+    yielded = {}
     while True:
-        # Get all CSV files in the directory
-        files = [f for f in os.listdir(directory) if f.endswith('.csv')]
-
-        for file_name in files:
-            # Check if the file has been read before
-            if file_name in processed_files:
+        now = time.monotonic()
+        for file_name in os.listdir(directory):
+            if not file_name.endswith('.csv'):
                 continue
-
             file_path = os.path.join(directory, file_name)
-            column_count = detect_column_count(file_path)
-
-            # Extract the table name from the file name (excluding the extension)
-            table_name = os.path.splitext(file_name)[0]
-
-            # Create the PostgreSQL table if it doesn't exist
-            create_table_query = f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
-
-            with open(file_path, 'r') as csv_file:
-                csv_reader = csv.reader(csv_file)
-                header_row = next(csv_reader)  # Get the header row
-
-                for i, column_name in enumerate(header_row):
-                    create_table_query += f'"{column_name}" VARCHAR, '
-
-            create_table_query = create_table_query.rstrip(', ') + ');'
-
-            cursor.execute(create_table_query)
-            conn.commit()
-
-            # Insert data from the CSV file into the PostgreSQL table
-            with open(file_path, 'r') as csv_file:
-                csv_reader = csv.reader(csv_file)
-                next(csv_reader)  # Skip the header row
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
 
-                insert_query = f'INSERT INTO "{table_name}" VALUES ({", ".join(["%s"] * column_count)})'
+            version = (stat.st_size, stat.st_mtime)
+            if seen.get(file_path, (None, None))[0] != version:
+                seen[file_path] = (version, now)
+            elif now - seen[file_path][1] >= settle_time and yielded.get(file_path) != version:
+                yielded[file_path] = version
+                yield file_path
 
-                for row in csv_reader:
-                    cursor.execute(insert_query, row)
-                    conn.commit()
-                
-                conn.close()
-            # Add the file name to the set of processed files
-            print(file_name, " has been processed!")
+        time.sleep(min(poll_interval, settle_time))
 
-        # Write the processed files back to the output file
-        with open(output_file_path, "w") as output_file:
-            output_file.write('\n'.join(processed_files))
+def existing_files(directory):
+    # Files already there at startup; csv_ingest skips the loaded ones
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.csv')]
 
-        # Sleep for 1 minute before checking for new files again
-        time.sleep(30)
-        print("Checking for new files....")
-        # quit()
+# Function to load CSV files from a directory as they arrive, each into its own PostgreSQL table
+def read_csv_files(directory):
+    with connect().cursor() as cursor:
+        cursor.execute(create_state_query)
+    connect().commit()
+
+    events = None
+    if INotify is not None:
+        try:
+            events = watch_inotify(directory)
+            print("Watching", directory, "with inotify")
+        except OSError as e:
+            print("inotify unavailable, polling instead:", e)
+
+    # The polling watcher also finds the files already in the directory
+    startup_files = existing_files(directory) if events is not None else []
+    if events is None:
+        print("Polling", directory, "for new files")
+        events = watch_polling(directory)
+
+    # Waiting files are bounded too, so a burst does not queue without limit
+    slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def submit(file_path):
+        slots.acquire()
+        future = executor.submit(ingest, file_path)
+        future.add_done_callback(lambda _: slots.release())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for file_path in startup_files:
+            submit(file_path)
+        for file_path in events:
+            submit(file_path)
 
 # Specify the directory containing the CSV files
 csv_directory = "/Users/datax/aivahub/csv"
 
-# Call the function to read CSV files and insert data into PostgreSQL tables
-read_csv_files(csv_directory)
+if __name__ == '__main__':
+    # Call the function to load CSV files into PostgreSQL tables
+    read_csv_files(csv_directory)
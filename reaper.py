@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+import queries
+import tasks
+import job_queue
+import upload_jobs
+from db import connection
+from results_table import ensure_summary_columns
+from upload_jobs import job_backend
+
+load_dotenv()
+
+# Finds uploads stuck at 'processing' (worker killed, deploy, lost task) and
+# resumes them: the rows already in review_results are kept and only the
+# missing ones are classified again (upload_jobs.process_rows).
+#
+#   python reaper.py         check every REAPER_INTERVAL seconds
+#   python reaper.py once    check once and exit
+
+# An upload with no rows stored for this long is considered stalled
+stall_timeout = int(os.getenv('UPLOAD_STALL_TIMEOUT', '1800'))  # seconds
+# A stalled Celery upload whose task or chord callback is still pending is
+# left alone (its chunks may just be waiting their turn) until this long,
+# then its messages are taken as lost
+abandon_timeout = int(os.getenv('UPLOAD_ABANDON_TIMEOUT', '21600'))  # seconds
+# Uploads resumed this often are marked failed by the reaper instead
+max_resumes = int(os.getenv('UPLOAD_MAX_RESUMES', '3'))
+reap_interval = int(os.getenv('REAPER_INTERVAL', '60'))  # seconds
+
+# Stalled uploads with their seconds since the last stored row
+stalled_query = """
+SELECT id, filename, job_id, resume_count, last_progress_at,
+       extract(epoch FROM CURRENT_TIMESTAMP - last_progress_at)
+FROM csv_upload
+WHERE status = 'processing'
+  AND last_progress_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+"""
+
+# Take an upload for resuming unless another reaper (or new progress) got
+# there first
+claim_query = "UPDATE csv_upload SET last_progress_at = CURRENT_TIMESTAMP WHERE id = %s AND last_progress_at = %s"
+
+
+def in_flight(conn, uuid):
+    # Whether the upload still has work queued or running
+    if job_backend == 'postgres':
+        return job_queue.active_jobs(conn.cursor(), uuid) > 0
+    return tasks.in_flight(*queries.fetchone(conn, 'upload_job', uuid))
+
+def resume_upload(conn, uuid, filename, priority=None, abandoned=False):
+    # Requeue an upload without dropping its stored rows; returns the job id,
+    # or None while earlier work of it is still queued or running. With
+    # abandoned=True a pending Celery task is taken as lost.
+    if in_flight(conn, uuid) and not (abandoned and job_backend != 'postgres'):
+        return None
+
+    if job_backend == 'postgres':
+        cursor = conn.cursor()
+        job_queue.supersede(cursor, uuid)
+        job_id = job_queue.enqueue(cursor, 'upload', uuid, {'filename': filename, 'resume': True}, priority)
+    else:
+        job_id = tasks.dispatch_upload(conn, uuid, filename, priority, None, True)
+
+    queries.execute(conn, 'resume_processing', uuid)
+    return job_id
+
+def reap_stalled():
+    # Resume every stalled upload, or fail it once it was resumed
+    # max_resumes times; returns {upload id: job id} of those resumed
+    resumed = {}
+    with connection() as conn:
+        cursor = conn.cursor()
+        ensure_summary_columns(cursor)
+        cursor.execute(stalled_query, (stall_timeout,))
+
+        for uuid, filename, job_id, resume_count, last_progress_at, stalled_for in cursor.fetchall():
+            uuid = str(uuid)
+            if resume_count >= max_resumes:
+                print(f"{uuid}: stalled after {resume_count} resumes, upload failed")
+                upload_jobs.fail_upload(conn, uuid)
+                continue
+
+            abandoned = stalled_for >= abandon_timeout
+            if in_flight(conn, uuid) and not (abandoned and job_backend != 'postgres'):
+                print(f"{uuid}: no progress in {int(stalled_for)}s but its jobs are still queued, left alone")
+                continue
+
+            cursor.execute(claim_query, (uuid, last_progress_at))
+            if cursor.rowcount == 0:
+                continue
+
+            job_id = resume_upload(conn, uuid, filename, abandoned=abandoned)
+            if job_id is not None:
+                print(f"{uuid}: no progress in {int(stalled_for)}s, resumed as job {job_id}")
+                resumed[uuid] = job_id
+
+    return resumed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'once':
+        reap_stalled()
+        sys.exit(0)
+
+    while True:
+        try:
+            reap_stalled()
+        except Exception as e:
+            print('Reaper check failed:', e)
+        time.sleep(reap_interval)
@@ -0,0 +1,336 @@
+import os
+import json
+import time
+
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Result rows are written in batches of this size, or after this many
+# seconds, whichever comes first
+flush_size = int(os.getenv('RESULT_BATCH_SIZE', '500'))
+flush_interval = float(os.getenv('RESULT_FLUSH_SECONDS', '1'))
+
+# Default and largest page size of /status results
+page_limit = int(os.getenv('RESULTS_PAGE_LIMIT', '1000'))
+max_page_limit = int(os.getenv('RESULTS_MAX_PAGE_LIMIT', '10000'))
+# Rows fetched from the server-side cursor per round trip
+fetch_size = int(os.getenv('RESULTS_FETCH_SIZE', '500'))
+
+# Number of hash partitions of review_results. Only read when the table is
+# first created; changing it later needs a new table.
+partition_count = int(os.getenv('RESULT_PARTITIONS', '16'))
+
+# Stored values of the status and result enums
+status_values = ('Compliant', 'Violation', 'N/A')
+result_values = ('yes', 'no', 'maybe', 'n/a')
+
+# Every upload's results live in one table, hash-partitioned by upload id.
+# row_no is the CSV row number, so (upload_id, row_no) gives file order.
+create_types_query = f"""
+DO $$
+BEGIN
+    CREATE TYPE review_status AS ENUM ({', '.join(f"'{value}'" for value in status_values)});
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+DO $$
+BEGIN
+    CREATE TYPE review_result AS ENUM ({', '.join(f"'{value}'" for value in result_values)});
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+"""
+
+create_table_query = """
+CREATE TABLE IF NOT EXISTS review_results (
+    upload_id UUID NOT NULL,
+    row_no INTEGER NOT NULL,
+    review TEXT,
+    status review_status NOT NULL,
+    reason TEXT,
+    result review_result NOT NULL,
+    source VARCHAR(16),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (upload_id, row_no)
+) PARTITION BY HASH (upload_id)
+"""
+
+# Rows are inserted and the upload's counters in csv_upload bumped in one
+# statement, so the counters always match the stored rows. Rows already
+# stored (ON CONFLICT) are not counted twice. The same statement moves the
+# chunk's checkpoint and the upload's last_progress_at. {upload_id},
+# {tokens} and {checkpoint} are filled in per flush.
+insert_query = """
+WITH inserted AS (
+    INSERT INTO review_results (upload_id, row_no, review, status, reason, result, source)
+    VALUES %s
+    ON CONFLICT (upload_id, row_no) DO NOTHING
+    RETURNING result, source
+), counts AS (
+    SELECT
+        count(*) AS processed,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'yes') AS yes,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'no') AS no,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'maybe') AS maybe,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'n/a') AS na
+    FROM inserted
+)
+UPDATE csv_upload SET
+    processed_rows = processed_rows + counts.processed,
+    yes_count = yes_count + counts.yes,
+    no_count = no_count + counts.no,
+    maybe_count = maybe_count + counts.maybe,
+    na_count = na_count + counts.na,
+    tokens_used = tokens_used + {tokens},
+    last_progress_at = CURRENT_TIMESTAMP{checkpoint}
+FROM counts
+WHERE csv_upload.id = {upload_id}
+"""
+
+# Per-upload counters, kept up to date by ResultWriter
+summary_columns = ('total_rows', 'processed_rows', 'yes_count', 'no_count', 'maybe_count', 'na_count', 'tokens_used')
+
+# Recount the counters of an upload from its stored rows, when a stalled
+# upload is resumed (tokens_used is kept)
+recount_query = """
+UPDATE csv_upload SET
+    total_rows = %(total)s,
+    processed_rows = counts.processed,
+    yes_count = counts.yes,
+    no_count = counts.no,
+    maybe_count = counts.maybe,
+    na_count = counts.na,
+    last_progress_at = CURRENT_TIMESTAMP
+FROM (
+    SELECT
+        count(*) AS processed,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'yes') AS yes,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'no') AS no,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'maybe') AS maybe,
+        count(*) FILTER (WHERE source <> 'rating' AND result = 'n/a') AS na
+    FROM review_results
+    WHERE upload_id = %(upload_id)s
+) counts
+WHERE csv_upload.id = %(upload_id)s
+"""
+
+# Keyset pagination on the primary key: rows after a row_no, in file order
+select_query = """
+SELECT row_no, status, reason, result
+FROM review_results
+WHERE upload_id = %s AND row_no > %s
+ORDER BY row_no
+"""
+
+# Rows in any of several row_no ranges lo < row_no <= hi, in file order; the
+# /events stream reads each chunk of an upload from where it left off
+ranges_query = """
+SELECT r.row_no, r.status, r.reason, r.result
+FROM unnest(%s::integer[], %s::integer[]) AS c (lo, hi)
+JOIN review_results r ON r.upload_id = %s AND r.row_no > c.lo AND r.row_no <= c.hi
+ORDER BY r.row_no
+LIMIT %s
+"""
+
+# Every flush and status change of an upload is announced here, for the
+# /events stream (upload_events.py)
+events_channel = 'upload_events'
+
+results_ready = False
+summary_ready = False
+
+
+def status_value(status):
+    # The model answers 'Compliant' or 'Violation'; anything else is N/A
+    if 'violat' in status.lower():
+        return 'Violation'
+    elif 'compliant' in status.lower():
+        return 'Compliant'
+    return 'N/A'
+
+def result_value(result):
+    result = result.lower()
+    return result if result in result_values else 'n/a'
+
+def notify_upload(cursor, upload_id, **fields):
+    # NOTIFY listeners that an upload has new rows (row_no) or a new status;
+    # the payload is only a pointer, listeners read the rows themselves
+    cursor.execute(
+        "SELECT pg_notify(%s, %s)",
+        (events_channel, json.dumps({'upload_id': str(upload_id), **fields}))
+    )
+
+def ensure_results_table(cursor):
+    # Create the enums, review_results and its partitions if they don't exist.
+    # Runs once per process.
+    global results_ready
+    if results_ready:
+        return
+
+    cursor.execute(create_types_query)
+    cursor.execute(create_table_query)
+    for remainder in range(partition_count):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS review_results_p{remainder} PARTITION OF review_results '
+            f'FOR VALUES WITH (MODULUS {partition_count}, REMAINDER {remainder})'
+        )
+
+    ensure_summary_columns(cursor)
+    results_ready = True
+
+def ensure_summary_columns(cursor):
+    # Counter columns of csv_upload, added once per process
+    global summary_ready
+    if summary_ready:
+        return
+
+    for column in summary_columns:
+        cursor.execute(f'ALTER TABLE csv_upload ADD COLUMN IF NOT EXISTS {column} BIGINT NOT NULL DEFAULT 0')
+    # Checkpoints: {chunk start row: last row stored}, and when rows were
+    # last stored; see reaper.py
+    cursor.execute("ALTER TABLE csv_upload ADD COLUMN IF NOT EXISTS row_checkpoints JSONB NOT NULL DEFAULT '{}'")
+    cursor.execute('ALTER TABLE csv_upload ADD COLUMN IF NOT EXISTS last_progress_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP')
+    # The upload's Celery task or chord in flight, and how often it was resumed
+    cursor.execute('ALTER TABLE csv_upload ADD COLUMN IF NOT EXISTS job_id VARCHAR')
+    cursor.execute('ALTER TABLE csv_upload ADD COLUMN IF NOT EXISTS resume_count INTEGER NOT NULL DEFAULT 0')
+
+    summary_ready = True
+
+def start_summary(cursor, upload_id, total):
+    # Reset the counters of an upload before its rows are written
+    ensure_summary_columns(cursor)
+    cursor.execute(
+        f"UPDATE csv_upload SET total_rows = %s, {', '.join(f'{column} = 0' for column in summary_columns[1:])}, "
+        "row_checkpoints = '{}', last_progress_at = CURRENT_TIMESTAMP WHERE id = %s",
+        (total, upload_id)
+    )
+
+def recount_summary(cursor, upload_id, total):
+    # Counters of a resumed upload, from the rows stored before it stalled
+    ensure_summary_columns(cursor)
+    cursor.execute(recount_query, {'total': total, 'upload_id': upload_id})
+
+def checkpoint(cursor, upload_id, start):
+    # Last row stored by the chunk starting at row `start`, or None
+    cursor.execute("SELECT (row_checkpoints ->> %s)::integer FROM csv_upload WHERE id = %s", (str(start), upload_id))
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+def set_checkpoint(cursor, upload_id, start, row_no):
+    # Mark the chunk starting at row `start` done up to row_no, also when its
+    # last rows were skipped and never stored
+    cursor.execute(
+        "UPDATE csv_upload SET row_checkpoints = row_checkpoints || jsonb_build_object(%s::text, %s::integer) WHERE id = %s",
+        (start, row_no, upload_id)
+    )
+
+def stored_rows(cursor, upload_id, start, stop):
+    # Row numbers start <= row_no < stop already in review_results
+    cursor.execute(
+        "SELECT row_no FROM review_results WHERE upload_id = %s AND row_no >= %s AND row_no < %s",
+        (upload_id, start, stop)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+def iter_results(conn, upload_id, after=0, limit=None):
+    # Yield (row_no, status, reason, result) of an upload in file order,
+    # starting after row_no `after`. Rows come from a named (server-side)
+    # cursor fetch_size at a time, so memory stays flat for any upload size.
+    query = select_query + (' LIMIT %s' if limit is not None else '')
+    params = (upload_id, after) + ((limit,) if limit is not None else ())
+
+    # WITH HOLD so the cursor also works on autocommit connections
+    cursor = conn.cursor(name=f'results_{upload_id}_{after}'.replace('-', '_'), withhold=True)
+    cursor.itersize = fetch_size if limit is None else min(fetch_size, limit)
+    try:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+def fetch_results(conn, upload_id, after=0, limit=None):
+    # One page of iter_results as a list
+    return list(iter_results(conn, upload_id, after, limit))
+
+def fetch_ranges(conn, upload_id, ranges, limit):
+    # Up to `limit` rows (row_no, status, reason, result) in the (lo, hi]
+    # ranges, in file order
+    if not ranges:
+        return []
+    cursor = conn.cursor()
+    cursor.execute(ranges_query, ([lo for lo, hi in ranges], [hi for lo, hi in ranges], upload_id, limit))
+    return cursor.fetchall()
+
+
+class ResultWriter:
+    # Buffers result rows and writes them with one multi-row INSERT per
+    # batch, in the order they were added. Use it as a context manager so
+    # the buffer is flushed when the job ends, also when it fails.
+
+    def __init__(self, conn, upload_id, size=None, interval=None, usage=None, chunk=None):
+        self.conn = conn
+        self.upload_id = upload_id
+        # Start row of the chunk being written, if any; each flush records
+        # its last row as the chunk's checkpoint. Rows must be added in order.
+        self.chunk = chunk
+        self.size = size or flush_size
+        self.interval = flush_interval if interval is None else interval
+        # Optional callable returning the job's tokens used so far; the
+        # difference since the last flush is added to the upload's counter
+        self.usage = usage
+        self.tokens_counted = 0
+        self.rows = []
+        self.last_flush = time.monotonic()
+        self.written = 0
+
+    def add(self, row_no, review, status, reason, result, source):
+        self.rows.append((
+            self.upload_id, row_no, review, status_value(status), reason, result_value(result), source
+        ))
+
+        if len(self.rows) >= self.size or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return
+
+        tokens = self.usage() if self.usage is not None else self.tokens_counted
+
+        cursor = self.conn.cursor()
+        checkpoint = ''
+        if self.chunk is not None:
+            checkpoint = cursor.mogrify(
+                ',\n    row_checkpoints = row_checkpoints || jsonb_build_object(%s::text, %s::integer)',
+                (self.chunk, self.rows[-1][1])
+            ).decode()
+        query = insert_query.format(
+            upload_id=cursor.mogrify('%s', (self.upload_id,)).decode(),
+            tokens=int(tokens - self.tokens_counted),
+            checkpoint=checkpoint
+        )
+        execute_values(cursor, query, self.rows, page_size=len(self.rows))
+        notify_upload(cursor, self.upload_id, row_no=self.rows[-1][1])
+        self.conn.commit()
+
+        self.tokens_counted = tokens
+        self.written += len(self.rows)
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Keep what was classified before an error. If the flush fails too
+        # (e.g. the connection is gone), the original error is the one raised.
+        if exc_type is None:
+            self.flush()
+            return False
+
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"{self.upload_id}: could not store {len(self.rows)} buffered rows after {exc_type.__name__}: {e}")
+        return False
@@ -0,0 +1,101 @@
+import re
+import csv
+import unicodedata
+
+
+def has_unicode_characters(text):
+    for char in text:
+        if ord(char) > 127:
+            return True
+    return False
+
+def remove_unicode(sentence):
+    # Remove Unicode characters and replace them with a space
+    clean_sentence = re.sub(r'[^\x00-\x7F]', ' ', sentence)
+
+    # Replace any multiple spaces with a single space
+    clean_sentence = re.sub(r' +', ' ', clean_sentence)
+
+    return clean_sentence
+
+def correct_spanish_text(text):
+    try:
+        # Normalize the text using NFKD normalization form
+        normalized_text = unicodedata.normalize('NFKD', text)
+
+        # Replace incorrect characters with their correct counterparts
+        corrected_text = normalized_text.encode('latin-1', 'ignore').decode('utf-8')
+
+        return corrected_text
+    except UnicodeDecodeError:
+        # Handle decoding error
+        print("Decoding error occurred. Unable to correct the text.")
+        return text
+
+def clean_review(body):
+    review = f"{body}"
+    unicode = has_unicode_characters(review)
+    review = correct_spanish_text(review)
+
+    if unicode == True:
+        review = remove_unicode(review)
+
+    return review
+
+def find_review_columns(fieldnames):
+    # (title, body, rating) column names of an Amazon review export, or None
+    title_column = None
+    body_column = None
+    ratings_column = None
+
+    for column in fieldnames or []:
+        if column.lower() == "title":
+            title_column = column
+        elif column.lower() == "body":
+            body_column = column
+        elif column.lower() == "rating":
+            ratings_column = column
+
+    if title_column is None or body_column is None or ratings_column is None:
+        return None
+
+    return title_column, body_column, ratings_column
+
+def read_reviews(csv_reader, columns, start=1, stop=None):
+    # Yield (i, review, needs_llm) for every usable row in file order.
+    # 4-5 star rows are stored as N/A; 1-3 star rows go to the classifier.
+    # start and stop limit the rows to start <= i < stop, for chunked jobs.
+    title_column, body_column, ratings_column = columns
+
+    for i, row in enumerate(csv_reader, start=1):
+        if i < start:
+            continue
+        if stop is not None and i >= stop:
+            break
+
+        # Extract the title and body from the CSV row
+        title = row[title_column]
+        body = row[body_column]
+        rating = row[ratings_column]
+
+        # Check if the title or body is None
+        if title is None or body is None:
+            continue
+
+        # Check if the rating value is 4 or 5
+        elif rating in ['4', '5']:
+            # Combine the title and body columns with a comma separator
+            yield i, f"{title}, {body}", False
+
+        elif rating in ['1', '2', '3']:
+            yield i, clean_review(body), True
+
+def count_reviews(path, columns):
+    # Number of rows read_reviews yields for the CSV file, for progress totals
+    with open(path, 'r') as csv_file:
+        return sum(1 for _ in read_reviews(csv.DictReader(csv_file), columns))
+
+def count_rows(path):
+    # Number of data rows in the CSV file, usable or not
+    with open(path, 'r') as csv_file:
+        return sum(1 for _ in csv.DictReader(csv_file))
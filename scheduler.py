@@ -0,0 +1,38 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Fair scheduling of chunks across concurrent uploads. Each chunk gets a
+# virtual finish tag (weighted fair queuing): the tags of one upload grow by
+# chunk rows / priority, starting at the current virtual time. Workers take
+# the smallest tag first, so a 30-row upload queued behind a 6K-row one runs
+# its chunk next, and large uploads share the remaining capacity by priority.
+
+default_priority = int(os.getenv('JOB_DEFAULT_PRIORITY', '1'))
+max_priority = int(os.getenv('JOB_MAX_PRIORITY', '10'))
+# Chunks of uploads due within this many seconds jump the fair order
+deadline_slack = int(os.getenv('JOB_DEADLINE_SLACK', '60'))
+
+
+def clamp_priority(priority):
+    if priority is None:
+        return default_priority
+    return max(1, min(int(priority), max_priority))
+
+def chunk_tags(chunks, virtual_time, priority):
+    # Virtual finish tag of each (start, stop) chunk of one upload
+    tags = []
+    finish = virtual_time
+    for start, stop in chunks:
+        finish += (stop - start) / clamp_priority(priority)
+        tags.append(finish)
+    return tags
+
+def celery_priority(index, priority):
+    # Redis priority level (0 is served first) for the index-th chunk of an
+    # upload: round-robin by chunk index, scaled down by the upload priority,
+    # so the first chunks of every active upload run before the rest
+    return min(9, index // clamp_priority(priority))
+
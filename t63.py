@@ -12,7 +12,7 @@ from celery import Celery
 import psycopg2
 from psycopg2 import Error
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from openai.error import RateLimitError
+from rate_limiter import call_with_limits, estimate_tokens
 from google.cloud import storage
 
 from langchain import LLMChain
@@ -81,20 +81,8 @@ if conn is None:
 chat_llm = ChatOpenAI(temperature=0.8)
 
 def completion_with_retry(prompt):
-    retry_delay = 1.0
-    max_retries = 3
-    retries = 0
-
-    while True:
-        try:
-            return chat_llm.chat(prompt).get('choices')[0]['message']['content']
-        except RateLimitError as e:
-            if retries >= max_retries:
-                raise e
-            else:
-                retries += 1
-                print(f"Rate limit exceeded. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+    # Shared request/token limiter with exponential backoff, see rate_limiter.py
+    return call_with_limits(lambda: chat_llm.chat(prompt).get('choices')[0]['message']['content'], estimate_tokens(str(prompt)))
 
 
 @app.route('/')
@@ -1,27 +1,20 @@
-import re
-import unicodedata
-import urllib.request
-import urllib.error
 import os
-import csv
 import json
 import ssl
-import sys
 import time
 import requests
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
 from flask_cors import CORS
-from celery import Celery
-import psycopg2
 from psycopg2 import Error
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from openai.error import RateLimitError
 from google.cloud import storage
-from guide import guidelines_prompt
-from transformers import GPT2Tokenizer
-
-from langchain import LLMChain
-from langchain.chat_models import ChatOpenAI
+from db import connection, db_pool
+import queries
+from results_table import ensure_summary_columns, fetch_results, iter_results, max_page_limit, page_limit, summary_columns
+from tasks import dispatch_upload
+from job_queue import enqueue, queue_stats
+from upload_jobs import job_backend
+from reaper import resume_upload
+from upload_events import stream_events
 
 # Define the Cloud SQL PostgreSQL connection details
 from dotenv import load_dotenv
@@ -44,93 +37,7 @@ os.environ['OPENAI_API_KEY'] = openai_api_key
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Configure Celery
-app.config['CELERY_BROKER_URL'] = 'redis://localhost:6379/0'
-app.config['CELERY_RESULT_BACKEND'] = 'redis://localhost:6379/0'
-
-celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
-celery.conf.update(app.config)
-
-# Connect to the Cloud SQL PostgreSQL database
-def connect_to_database():
-    retry_count = 0
-    max_retries = 10
-    retry_delay = 5  # seconds
-
-    while retry_count < max_retries:
-        try:
-            conn = psycopg2.connect(
-                user=db_user,
-                password=db_password,
-                host=db_host,
-                port=db_port,
-                database=db_name
-            )
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            print('Connected to Cloud SQL PostgreSQL database')
-            return conn
-        except Error as e:
-            print('Error connecting to Cloud SQL PostgreSQL database:', e)
-            retry_count += 1
-            print(f'Retrying connection ({retry_count}/{max_retries})...')
-            time.sleep(retry_delay)
-
-# Connect to the database
-conn = connect_to_database()
-
-# Check if the connection was successful
-if conn is None:
-    print('Unable to connect to the database. Exiting...')
-    sys.exit(1)
-
-
-def load_fine_tune(cursor):
-    
-    global guidelines_prompt
-
-    # query = "SELECT * FROM tune_data4"
-    query = "SELECT * FROM tune_data4 LIMIT 12"
-
-    cursor.execute(query)
-    # Fetch all the rows from the result set
-    rows = cursor.fetchall()
-
-    # Create a variable to store the formatted examples
-    fine_tune = ""
-
-    for row in rows:
-        review = row[0]
-        # status = str(row[2])
-        status2 = str(row[5])
-        # reason = row[1]
-        reason2 = row[4]
-        # result = str(row[3])
-        result2 = str(row[6])
-
-        # Format the example
-        data = (
-            '"review": "' + str(review) + '",\n' +
-            # '"status": "' + status + '",\n' +
-            '"status": "' + status2 + '",\n' +
-            # '"reason": "' + str(reason) + '",\n' +
-            '"reason": "' + str(reason2) + '",\n' +
-            # '"result": "' + result + '",\n' +
-            '"result": "' + result2 + '"\n\n'
-        )
-        # print(data)
-        # Append the formatted example to the output
-        fine_tune += data
-
-    # Replace {fine_tune} with the actual value
-    guidelines_prompt = guidelines_prompt.format(fine_tune=fine_tune)
-
-    return guidelines_prompt
-
-# Calculates the number of tokens used in the given guidelines_prompt:
-# tokenizer = GPT2Tokenizer.from_pretrained('gpt2')
-# tokenized_prompt = tokenizer.encode(guidelines_prompt, add_special_tokens=False)
-# num_tokens = len(tokenized_prompt)
-# print("Number of tokens used:", num_tokens)
+# Connections come from the shared pool in db.py, one per request or job
 
 @app.route('/')
 def index():
@@ -183,11 +90,8 @@ def upload_to_gcs():
                 'id': uuid,
             }
 
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE csv_upload SET status = %s WHERE id = %s",
-                ("processing", uuid)
-            )
+            with connection() as conn:
+                queries.execute(conn, 'set_upload_status', uuid, "processing")
             return jsonify(response), 200
 
         else:
@@ -204,34 +108,64 @@ def process_csv(ff_id):
     new_filename = get_filename(ff_id)
 
     if new_filename is not None:
-        # Call 1 to process the uploaded file
-        process_csv_and_openAI(bucket_name, new_filename, ff_id)
-        data = get_gpt_data(ff_id)
-        print(data)
-        if data == None:
-            data = "CSV contains 4-5 ratings only, no data has been processed."
-            
+        # Hand the job to the workers and answer right away;
+        # poll /summary or /status with the file id for progress and results
+        # Scheduling hints: ?priority=1-10 weighs the upload's share of the
+        # workers, ?deadline=<seconds> asks for it to be done that soon
+        priority = request.args.get('priority', type=int)
+        deadline = request.args.get('deadline', type=int)
+
+        with connection() as conn:
+            ensure_summary_columns(conn.cursor())
+            queries.execute(conn, 'start_processing', ff_id)
+
+            if job_backend == 'postgres':
+                # Postgres job queue (job_queue.py), for deployments without Redis
+                job_id = enqueue(conn.cursor(), 'upload', ff_id, {'filename': new_filename}, priority, deadline)
+            else:
+                deadline_at = time.time() + deadline if deadline is not None else None
+                job_id = dispatch_upload(conn, ff_id, new_filename, priority, deadline_at)
+
         response_data = {
-            'status': 'complete',
-            'gpt_data': data
+            'status': 'processing',
+            'id': ff_id,
+            'job_id': job_id
         }
 
-        return jsonify(response_data), 200
-        # return jsonify({'File/GPT uploaded successfully:': data}), 200
+        return jsonify(response_data), 202
     else:
         return jsonify({'error': 'Invalid file ID'}), 400
+
+
+@app.route('/resume/<string:ff_id>', methods=['GET'])
+def resume_csv(ff_id):
+    # Pick up an interrupted upload where it stopped: rows already stored are
+    # kept and only the rest go to the model. reaper.py does the same for
+    # uploads that stall on their own.
+    new_filename = get_filename(ff_id)
+    if new_filename is None:
+        return jsonify({'error': 'Invalid file ID'}), 400
+
+    if get_file_details(ff_id) == "completed":
+        return jsonify({'error': 'Upload is already completed'}), 409
+
+    priority = request.args.get('priority', type=int)
+
+    with connection() as conn:
+        ensure_summary_columns(conn.cursor())
+        job_id = resume_upload(conn, ff_id, new_filename, priority)
+
+    if job_id is None:
+        return jsonify({'error': 'Upload still has jobs in the queue'}), 409
+
+    return jsonify({'status': 'processing', 'id': ff_id, 'job_id': job_id}), 202
     
 # Define a function to insert a row with file details into the database
 def insert_file_details(filename):
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO csv_upload (filename, status) VALUES (%s, %s) RETURNING id",
-            (filename, "processing")
-        )
-        
-        row_id = cursor.fetchone()[0]
-        conn.commit()
+        with connection() as conn:
+            row_id = queries.fetchone(conn, 'insert_upload', filename, "processing")[0]
+            conn.commit()
         print('File details inserted successfully')
 
         return row_id
@@ -244,14 +178,9 @@ def insert_file_details(filename):
 # Define a function to retrieve file details from the database by ID
 def get_file_details(ff_idd):
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT status FROM csv_upload WHERE id = %s",
-            (ff_idd,)
-        )
-        
-        # Fetch the result as a tuple
-        result = cursor.fetchone()
+        with connection() as conn:
+            # Fetch the result as a tuple
+            result = queries.fetchone(conn, 'upload_status', ff_idd)
 
         # Extract the value from the tuple
         result = result[0]
@@ -262,33 +191,81 @@ def get_file_details(ff_idd):
         print('Error retrieving file details:', e)
         return jsonify({'error': 'Error inserting file details'}), e
 
-def get_gpt_data(fff_id):
+def result_data(row):
+    return {
+        'row_no': row[0],
+        'status': row[1],
+        'reason': row[2],
+        'result': row[3],
+        # Add more columns as needed
+    }
+
+def get_gpt_data(fff_id, after=0, limit=None):
+    # One page of results: rows after row_no `after`, at most `limit` of them
     try:
-
-        cursor = conn.cursor()
-        cursor.execute(
-            f'SELECT * FROM "{fff_id}"'
-        )
-        rows = cursor.fetchall()
+        with connection() as conn:
+            rows = fetch_results(conn, fff_id, after, limit)
 
         if rows:
-            result = []
-            for row in rows:
-                data = {
-                    # 'id': row[0],
-                    'status': row[2],
-                    'reason': row[3],
-                    'result': row[4].lower(),
-                    # Add more columns as needed
-                }
-                result.append(data)
-
-            return result
+            return [result_data(row) for row in rows]
 
     except Error as e:
         print('Error retrieving data from the table:', e)
         return jsonify({'error': 'Error retrieving data from the table'}), e
 
+def stream_gpt_data(fff_id, after=0):
+    # All results after row_no `after` as NDJSON, one row per line; the
+    # pooled connection is held while the client reads
+    with connection() as conn:
+        for row in iter_results(conn, fff_id, after):
+            yield json.dumps(result_data(row)) + '\n'
+
+
+@app.route('/db-stats', methods=['GET'])
+def get_db_stats():
+    # Pool size, connections in use, checkout wait time and query latencies
+    return jsonify({**db_pool.stats(), 'queries': queries.stats()}), 200
+
+
+@app.route('/events/<string:file_id>', methods=['GET'])
+def get_events(file_id):
+    # Server-sent events with progress and rows as they are committed,
+    # instead of polling /status. A reconnecting EventSource sends
+    # Last-Event-ID, the stream's cursor, and continues from there;
+    # ?after=<row_no> starts after a row.
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('after')
+
+    return Response(
+        stream_with_context(stream_events(file_id, cursor)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/queue-stats', methods=['GET'])
+def get_queue_stats():
+    # Chunks and queue wait of the active uploads in the Postgres job queue.
+    # With Celery, each upload's queue wait is in its finalize_upload result.
+    if job_backend != 'postgres':
+        return jsonify({'error': 'Queue stats are only kept with JOB_BACKEND=postgres'}), 404
+
+    with connection() as conn:
+        return jsonify(queue_stats(conn.cursor())), 200
+
+
+@app.route('/summary/<string:file_id>', methods=['GET'])
+def get_summary(file_id):
+    # Progress and yes/no/maybe/N/A counts from the csv_upload row alone,
+    # without touching the result rows
+    with connection() as conn:
+        ensure_summary_columns(conn.cursor())
+        row = queries.fetchone(conn, 'upload_summary', file_id)
+
+    if row is None:
+        return jsonify({'error': 'Invalid file ID'}), 404
+
+    return jsonify(dict(zip(('status',) + summary_columns, row))), 200
+
 
 @app.route('/status/<string:file_id>', methods=['GET'])
 def get_status(file_id):
@@ -303,16 +280,37 @@ def get_status(file_id):
         # formatted_status = file_details.lower()
 
         if file_details == "completed":
-            data = get_gpt_data(file_id)
+            # ?after=<row_no> continues from the last row of the previous page
+            after = request.args.get('after', 0, type=int)
+
+            # ?format=ndjson streams every remaining row instead of one page
+            if request.args.get('format') == 'ndjson':
+                return Response(
+                    stream_with_context(stream_gpt_data(file_id, after)),
+                    mimetype='application/x-ndjson'
+                )
+
+            limit = request.args.get('limit', page_limit, type=int)
+            limit = max(1, min(limit, max_page_limit))
+
+            data = get_gpt_data(file_id, after, limit)
             print(data)
+            next_after = None
             if data == None:
-                data = "CSV contains 4-5 ratings only, no data has been processed."
+                if after == 0:
+                    data = "CSV contains 4-5 ratings only, no data has been processed."
+            elif len(data) == limit:
+                next_after = data[-1]['row_no']
 
             response_data = {
                 'status': 'complete',
-                'gpt_data': data
+                'gpt_data': data,
+                # Pass as ?after= to get the next page; None on the last page
+                'next_after': next_after
             }
             return jsonify(response_data), 200
+        elif file_details == "failed":
+            return jsonify({"status": "failed"}), 200
         else:
             processing = {"status": "processing"}
             return jsonify(processing), 200
@@ -327,21 +325,11 @@ def get_status(file_id):
             return jsonify({'error': 'An HTTP error occurred'}), error
         
 
-def detect_column_count(file_path):
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
-        first_row = next(reader)
-        return len(first_row)
-
 def get_filename(ff_id):
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT filename FROM csv_upload WHERE id = %s",
-            (ff_id,)
-        )
-        # Fetch the result as a tuple
-        result = cursor.fetchone()
+        with connection() as conn:
+            # Fetch the result as a tuple
+            result = queries.fetchone(conn, 'upload_filename', ff_id)
 
         # Extract the value from the tuple
         result = result[0]
@@ -352,206 +340,6 @@ def get_filename(ff_id):
         print('Error retrieving file details:', e)
         return jsonify({'error': 'Error retrieving file details'}), e
 
-def has_unicode_characters(text):
-    for char in text:
-        if ord(char) > 127:
-            return True
-    return False
-
-def remove_unicode(sentence):
-    # Remove Unicode characters and replace them with a space
-    clean_sentence = re.sub(r'[^\x00-\x7F]', ' ', sentence)
-    
-    # Replace any multiple spaces with a single space
-    clean_sentence = re.sub(r' +', ' ', clean_sentence)
-    
-    return clean_sentence
-
-def correct_spanish_text(text):
-    try:
-        # Normalize the text using NFKD normalization form
-        normalized_text = unicodedata.normalize('NFKD', text)
-        
-        # Replace incorrect characters with their correct counterparts
-        corrected_text = normalized_text.encode('latin-1', 'ignore').decode('utf-8')
-        
-        return corrected_text
-    except UnicodeDecodeError:
-        # Handle decoding error
-        print("Decoding error occurred. Unable to correct the text.")
-        return text
-            
-def process_csv_and_openAI(bucket_name, new_filename, uuid):
-    try:
-        no_count = 0
-        yes_count = 0
-        maybe_count = 0
-        not_applicable = 0
-        total = 0
-
-        from langchain.prompts.few_shot import FewShotPromptTemplate
-        from langchain.prompts.prompt import PromptTemplate
-
-        # Download the file from the GCS bucket
-        storage_client = storage.Client()
-        bucket = storage_client.get_bucket(bucket_name)
-        blob = bucket.blob(new_filename)
-
-        # Create a temporary file path to download the file
-        temp_file_path = f"/tmp/{new_filename}"
-
-        # Download the file to the temporary file path
-        blob.download_to_filename(temp_file_path)
-
-        # Create the PostgreSQL table if it doesn't exist
-        # create_table_query = f'CREATE TABLE IF NOT EXISTS "{row_id}" (id SERIAL PRIMARY KEY,status TEXT,reason TEXT);'                  
-        # create_table_query = f'CREATE TABLE IF NOT EXISTS "{uuid}" (id SERIAL PRIMARY KEY, "tbody" VARCHAR, "status" VARCHAR, "reason" VARCHAR, "result" VARCHAR);'
-        create_table_query = f'CREATE TABLE IF NOT EXISTS "{uuid}" (id SERIAL PRIMARY KEY, "tbody" VARCHAR, "status" VARCHAR, "reason" VARCHAR, "result" VARCHAR, timestamp_column TIMESTAMP DEFAULT CURRENT_TIMESTAMP);'
-
-        # print(bucket_name, new_filename, uuid)
-        cursor = conn.cursor()
-        cursor.execute(create_table_query)
-        conn.commit()
-
-        # Create a cursor to execute SQL queries
-        cursor = conn.cursor()
-        # Call the function to create the fine_tune variable
-        guidelines_prompt = load_fine_tune(cursor)
-
-        # Insert data from the CSV file into the PostgreSQL table
-        with open(temp_file_path, 'r') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-
-            # Find the title and body columns
-            title_column = None
-            body_column = None
-            ratings_column = None
-            
-            for column in csv_reader.fieldnames:
-                if column.lower() == "title":
-                    title_column = column
-                elif column.lower() == "body":
-                    body_column = column
-                elif column.lower() == "rating":
-                    ratings_column = column
-
-            # Check if the title, body, and ratings columns are found
-            if title_column is None or body_column is None or ratings_column is None:
-                print("Title, body, and/or ratings columns not found in the CSV file.")
-                return jsonify({'error': 'Title, body and/or rating columns not found in the CSV file.'}), uuid
-            
-            insert_query = f'INSERT INTO "{uuid}" ("tbody", "status", "reason", "result") VALUES (%s, %s, %s, %s)'
-
-            # Process each row in the CSV file
-            # for row in csv_reader:
-            for i, row in enumerate(csv_reader, start=1):
-                # Extract the title and body from the CSV row
-                title = row[title_column]
-                body = row[body_column]
-                rating = row[ratings_column]
-
-                # Check if the title or body is None
-                if title is None or body is None:
-                    continue
-
-                # Check if the rating value is 4 or 5
-                elif rating in ['4', '5']:
-                    status = "N/A"
-                    reason = "N/A"
-                    result = "N/A"
-                    # Combine the title and body columns with a comma separator
-                    review = f"{title}, {body}"
-
-                    cursor.execute(insert_query, (review, status, reason, result))
-                    conn.commit()                
-                elif rating in ['1', '2', '3']:
-                    total += 1
-                    # Combine the title and body columns with a comma separator
-                    review = f"{body}"
-                    unicode = has_unicode_characters(review)
-                    review = correct_spanish_text(review)
-
-                    if unicode == True:                    
-                        review = remove_unicode(review)
-
-                    result = {'review': review}
-                    data_examples = [result]
-                
-                    example_prompt = PromptTemplate(
-                        input_variables=["review"],
-                        template='Review: \'{review}\'\nStatus: \nReason: \nResult:'
-                    )
-
-                    few_shot_template = FewShotPromptTemplate(
-                        examples=data_examples,
-                        example_prompt=example_prompt,
-                        prefix=guidelines_prompt,
-                        suffix='Review: \'{input}\'\nStatus: \nReason: \nResult:',
-                        input_variables=["input"]
-                    )
-
-                    chat_llm = ChatOpenAI(temperature=0.5)
-                    llm_chain = LLMChain(llm=chat_llm, prompt=few_shot_template)
-
-                    answer = llm_chain.run(review)
-                    # print(str(i) + " " + answer + '\n')
-
-                    # Extract reason
-                    reason_start = answer.find("Reason:") + len("Reason:")
-                    reason_end = answer.find("Result:")
-                    reason = answer[reason_start:reason_end].strip()
-
-                    # Extract status
-                    status_start = answer.find("Status:") + len("Status:")
-                    status_end = answer.find("\nReason:")
-                    status = answer[status_start:status_end].strip()
-
-                    # Extract result
-                    result_start = answer.find("Result:") + len("Result:")
-                    result = answer[result_start:].strip()
-
-                    print(i)
-                    print("Review:", review)
-                    print("Reason:", reason)
-                    print("Status:", status)
-                    print("Result:", result + '\n')
-
-                    if result.lower() == 'no':
-                        no_count += 1
-                    elif result.lower() == 'yes':
-                        yes_count += 1
-                    elif 'maybe' in result.lower():
-                        maybe_count += 1
-                        result = 'maybe'
-                    else:
-                        not_applicable += 1
-                        result = 'N/A'
-
-                    cursor.execute(insert_query, (review, status, reason, result.lower()))
-                    conn.commit()
-
-            # Print the counts
-            print("'Total' count:", total)
-            print("'No' count:", no_count)
-            print("'Yes' count:", yes_count)
-            print("'Maybe' count:", maybe_count)
-            print("'Not Applicable' count:", not_applicable)
-
-        # Clean up the temporary file
-        os.remove(temp_file_path)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "UPDATE csv_upload SET status = %s WHERE id = %s",
-            ("completed", uuid)
-        )        
-        conn.commit()
-        # return None
-        return jsonify({'status': 'completed'}), 200
-
-    except psycopg2.Error as e:
-        print("Error connecting to PostgreSQL:", e)
-        return jsonify({'error': 'Error connecting to PostgreSQL'}), 500
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+import os
+import time
+import uuid as uuid_module
+
+from celery import Celery, chord, states
+from dotenv import load_dotenv
+
+import queries
+import upload_jobs
+from db import connection
+from scheduler import celery_priority, deadline_slack
+
+load_dotenv()
+
+# Workers: celery -A tasks worker --concurrency=<processes>
+broker_url = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+result_backend = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+# Task results are kept this long; after that a task reads as PENDING
+result_expires = int(os.getenv('CELERY_RESULT_EXPIRES', '86400'))  # seconds
+
+celery = Celery('tasks', broker=broker_url, backend=result_backend)
+celery.conf.update(
+    task_acks_late=True,
+    result_expires=result_expires,
+    worker_prefetch_multiplier=1,
+    # Redis priority levels 0-9, 0 first; see scheduler.celery_priority
+    broker_transport_options={'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'},
+)
+
+
+def dispatch_upload(conn, uuid, filename, priority=None, deadline=None, resume=False):
+    # Queue process_upload and record its task id on the upload before it
+    # can run, so in_flight() sees the upload from the start; process_upload
+    # replaces it with its chord's id. Returns the task id.
+    task_id = str(uuid_module.uuid4())
+    queries.execute(conn, 'set_upload_job', uuid, task_id)
+    process_upload.apply_async((uuid, filename, priority, deadline, resume), task_id=task_id)
+    return task_id
+
+def in_flight(job_id, status, idle):
+    # Whether the recorded task or chord callback of a 'processing' upload
+    # is still waiting or running; idle is the seconds since its last stored
+    # row. PENDING also means an unknown or expired result, so it only counts
+    # while the upload made progress within the result expiry window.
+    if job_id is None or status != 'processing':
+        return False
+
+    state = celery.AsyncResult(job_id).state
+    if state == states.PENDING:
+        return idle is not None and idle < result_expires
+    return state in states.UNREADY_STATES
+
+@celery.task(name='tasks.process_upload')
+def process_upload(uuid, filename, priority=None, deadline=None, resume=False):
+    # Split the upload into row chunks and fan them out; finalize_upload runs
+    # once every chunk is stored. Chunks of all active uploads interleave by
+    # Redis priority level; an upload due by deadline (epoch seconds) within
+    # the slack gets the top level for all of its chunks. resume=True keeps
+    # the rows stored by an earlier run (reaper.py). A chunk that runs out
+    # of retries fails the chord, and fail_upload marks the upload failed.
+    prepared = upload_jobs.prepare_upload(uuid, filename, resume)
+    if prepared is None:
+        return {'error': 'Title, body and/or rating columns not found in the CSV file.'}
+
+    columns, chunks = prepared
+    if not chunks:
+        return upload_jobs.finish_upload([], uuid, filename)
+
+    urgent = deadline is not None and deadline - time.time() <= deadline_slack
+    enqueued_at = time.time()
+    result = chord([
+        process_chunk.s(uuid, filename, columns, start, stop, enqueued_at).set(
+            priority=0 if urgent else celery_priority(index, priority)
+        )
+        for index, (start, stop) in enumerate(chunks)
+    ], finalize_upload.s(uuid, filename)).on_error(fail_upload.s(uuid)).delay()
+
+    # From here on the upload is in flight as long as the chord's callback is
+    with connection() as conn:
+        queries.execute(conn, 'set_upload_job', uuid, result.id)
+    return {'chunks': len(chunks)}
+
+@celery.task(name='tasks.process_chunk', bind=True, max_retries=3)
+def process_chunk(self, uuid, filename, columns, start, stop, enqueued_at=None):
+    try:
+        return upload_jobs.process_chunk(uuid, filename, columns, start, stop, enqueued_at)
+    except Exception as e:
+        # Rows already stored are skipped on retry (ON CONFLICT DO NOTHING)
+        print(f"{uuid}: chunk {start}-{stop - 1} failed:", e)
+        raise self.retry(exc=e, countdown=10 * (self.request.retries + 1))
+
+@celery.task(name='tasks.finalize_upload')
+def finalize_upload(results, uuid, filename):
+    return upload_jobs.finish_upload(results, uuid, filename)
+
+@celery.task(name='tasks.fail_upload')
+def fail_upload(request, exc, traceback, uuid):
+    # Errback of the chord: Celery passes the failed task's request and error
+    print(f"{uuid}: task {request.id} failed, upload failed:", exc)
+    with connection() as conn:
+        upload_jobs.fail_upload(conn, uuid)
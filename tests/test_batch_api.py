@@ -0,0 +1,168 @@
+import os
+import sys
+import csv
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_api
+from batch_api import LocalBatchClient, run_batch_job
+
+
+def answer(status, result):
+    return f"Status: {status}\nReason: because\nResult: {result}"
+
+
+class FakeLLM:
+    model_name = 'gpt-test'
+    temperature = 0
+
+
+class FakeClassifier:
+    chat_llm = FakeLLM()
+    tokens_used = 0
+
+    def build_prompt(self, review):
+        return f"PROMPT {review}"
+
+
+class FakePipeline:
+    # Settles reviews containing 'cached' locally, everything else needs the
+    # model; answers() is the online path for reviews the batch lost
+
+    def __init__(self):
+        self.classifier = FakeClassifier()
+        self.online = []
+        self.remembered = []
+
+    def lookup(self, review):
+        if 'cached' in review:
+            return answer('Compliant', 'no'), 'cache'
+        return None
+
+    def remember(self, review, answer):
+        self.remembered.append(review)
+
+    def answers(self, items):
+        for item in items:
+            self.online.append(item[0])
+            yield item, (answer('Violation', 'yes'), 'model')
+
+    def verdict(self, review, answer, source):
+        status = answer.split('\n')[0].split(': ')[1]
+        result = answer.split('\n')[2].split(': ')[1]
+        return status, 'because', result
+
+    def print_stats(self, total):
+        pass
+
+
+class RecordingWriter:
+    rows = []
+
+    def __init__(self, conn, upload_id, **kwargs):
+        RecordingWriter.rows = []
+
+    def add(self, row_no, review, status, reason, result, source):
+        RecordingWriter.rows.append((row_no, status, result, source))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class RecordingClient(LocalBatchClient):
+    # Keeps the custom ids of each uploaded batch file; run_batch_job
+    # deletes the file once the rows are stored
+
+    def __init__(self, complete):
+        super().__init__(complete)
+        self.submitted = []
+
+    def upload(self, path):
+        with open(path) as file:
+            self.submitted.append([json.loads(line)['custom_id'] for line in file])
+        return super().upload(path)
+
+
+class FakeConn:
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self):
+        return mock.Mock(execute=lambda query, params=None: self.queries.append((query, params)))
+
+    def commit(self):
+        pass
+
+
+@mock.patch.object(batch_api, 'ResultWriter', RecordingWriter)
+@mock.patch.object(batch_api, 'ensure_results_table', lambda cursor: None)
+@mock.patch.object(batch_api, 'start_summary', lambda cursor, uuid, total: None)
+@mock.patch.object(batch_api, 'notify_upload', lambda cursor, uuid, **fields: None)
+class RunBatchJobTest(unittest.TestCase):
+
+    def write_csv(self, rows, fieldnames=('title', 'body', 'rating')):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_write_submit_read_store_in_file_order(self):
+        path = self.write_csv([
+            {'title': 'Bad', 'body': 'seller asked me to change my review', 'rating': '1'},
+            {'title': 'Great', 'body': 'love it', 'rating': '5'},
+            {'title': 'Meh', 'body': 'cached review text', 'rating': '2'},
+            {'title': 'Broken', 'body': 'stopped working after a week', 'rating': '3'},
+        ])
+        client = RecordingClient(
+            lambda prompt: answer('Violation', 'yes') if 'seller' in prompt else answer('Compliant', 'no')
+        )
+        pipeline = FakePipeline()
+
+        self.assertTrue(run_batch_job(FakeConn(), path, 'upload-1', client, pipeline))
+
+        # Only the reviews that need the model and aren't cached were submitted
+        self.assertEqual(client.submitted, [['row-1', 'row-4']])
+
+        self.assertEqual(RecordingWriter.rows, [
+            (1, 'Violation', 'yes', 'model'),
+            (2, 'N/A', 'N/A', 'rating'),
+            (3, 'Compliant', 'no', 'cache'),
+            (4, 'Compliant', 'no', 'model'),
+        ])
+        self.assertEqual(pipeline.online, [])
+
+    def test_lost_requests_go_through_the_dispatcher(self):
+        path = self.write_csv([
+            {'title': 'Bad', 'body': 'seller asked me to change my review', 'rating': '1'},
+            {'title': 'Broken', 'body': 'stopped working after a week', 'rating': '3'},
+        ])
+        client = LocalBatchClient(lambda prompt: answer('Compliant', 'no'))
+        client.create = lambda file_id: {'id': 'batch-1', 'status': 'expired', 'input_file_id': file_id}
+        client.results = lambda batch: iter(())
+        pipeline = FakePipeline()
+
+        self.assertTrue(run_batch_job(FakeConn(), path, 'upload-2', client, pipeline))
+
+        self.assertEqual(pipeline.online, [1, 2])
+        self.assertEqual([row[0] for row in RecordingWriter.rows], [1, 2])
+
+    def test_missing_columns_fail_the_upload(self):
+        path = self.write_csv([{'name': 'x'}], fieldnames=('name',))
+        conn = FakeConn()
+
+        self.assertFalse(run_batch_job(conn, path, 'upload-3', LocalBatchClient(None), FakePipeline()))
+        self.assertIn(('UPDATE csv_upload SET status = %s WHERE id = %s', ('failed', 'upload-3')), conn.queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
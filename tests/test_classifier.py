@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import answer_tokens, make_batches, parse_batch_answer
+
+
+def weight(item):
+    # (name, tokens) items; None tokens need no model call
+    return item[1]
+
+
+class MakeBatchesTest(unittest.TestCase):
+
+    def test_batches_hold_at_most_size_reviews(self):
+        items = [('a', 10), ('b', 10), ('c', 10), ('d', 10), ('e', 10)]
+        batches = list(make_batches(items, size=2, budget=10000, weight=weight))
+        self.assertEqual(batches, [items[0:2], items[2:4], items[4:5]])
+
+    def test_token_budget_closes_a_batch(self):
+        items = [('a', 100), ('b', 100), ('c', 100)]
+        budget = 2 * (100 + answer_tokens)
+        batches = list(make_batches(items, size=10, budget=budget, weight=weight))
+        self.assertEqual(batches, [items[0:2], items[2:3]])
+
+    def test_review_over_budget_gets_its_own_batch(self):
+        items = [('a', 10), ('big', 5000), ('b', 10)]
+        batches = list(make_batches(items, size=10, budget=1000, weight=weight))
+        self.assertEqual(batches, [[items[0]], [items[1]], [items[2]]])
+
+    def test_free_items_ride_along_in_order(self):
+        items = [('a', 10), ('free', None), ('b', 10), ('c', 10)]
+        batches = list(make_batches(items, size=2, budget=10000, weight=weight))
+        self.assertEqual(batches, [items[0:3], items[3:4]])
+
+    def test_free_items_are_capped_per_batch(self):
+        items = [(str(i), None) for i in range(7)]
+        batches = list(make_batches(items, size=2, budget=10000, weight=weight, length=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual([item for batch in batches for item in batch], items)
+
+    def test_no_items_no_batches(self):
+        self.assertEqual(list(make_batches([], size=2, budget=100, weight=weight)), [])
+
+
+class ParseBatchAnswerTest(unittest.TestCase):
+
+    def test_answers_by_id(self):
+        answer = (
+            "ID: 1\nStatus: Compliant\nReason: fine\nResult: no\n\n"
+            "ID: 2\nStatus: Violation\nReason: seller\nResult: yes"
+        )
+        self.assertEqual(parse_batch_answer(answer), {
+            '1': "Status: Compliant\nReason: fine\nResult: no",
+            '2': "Status: Violation\nReason: seller\nResult: yes",
+        })
+
+    def test_incomplete_answers_are_left_out(self):
+        answer = "ID: 1\nStatus: Compliant\n\nID: 2\nStatus: Violation\nReason: seller\nResult: yes"
+        self.assertEqual(list(parse_batch_answer(answer)), ['2'])
+
+    def test_answer_without_ids(self):
+        self.assertEqual(parse_batch_answer("Status: Compliant\nReason: fine\nResult: no"), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
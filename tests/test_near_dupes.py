@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_dupes import NearDuplicateIndex, bands, minhash, num_perm, shingles, similarity
+
+review = "The seller emailed me and offered a refund if I changed my review to five stars"
+
+
+class MinHashTest(unittest.TestCase):
+
+    def test_shingles_ignore_case_and_punctuation(self):
+        self.assertEqual(shingles("Great, great PRODUCT!"), {'great great product'})
+        self.assertEqual(shingles("Too short"), {'too short'})
+
+    def test_signature_is_stable(self):
+        signature = minhash(review)
+        self.assertEqual(len(signature), num_perm)
+        self.assertEqual(signature, minhash(review.upper() + '!!!'))
+        self.assertEqual(similarity(signature, minhash(review)), 1.0)
+
+    def test_different_reviews_are_not_similar(self):
+        other = minhash("Arrived broken and customer support never answered any of my emails")
+        self.assertLess(similarity(minhash(review), other), 0.2)
+
+
+class NearDuplicateIndexTest(unittest.TestCase):
+
+    def test_band_keys(self):
+        index = NearDuplicateIndex()
+        signature = minhash(review)
+        keys = index.band_keys(signature)
+        self.assertEqual(len(keys), bands)
+        self.assertEqual(keys, index.band_keys(minhash(review)))
+
+        changed = minhash(review)
+        changed[0] += 1
+        changed_keys = index.band_keys(changed)
+        self.assertNotEqual(changed_keys[0], keys[0])
+        self.assertEqual(changed_keys[1:], keys[1:])
+
+    def test_finds_the_same_review_reformatted(self):
+        index = NearDuplicateIndex(threshold=0.9, capacity=10)
+        index.add(review, ('Violation', 'seller', 'yes'))
+
+        self.assertEqual(index.find(review.lower() + '.'), ('Violation', 'seller', 'yes'))
+        self.assertIsNone(index.find("Arrived broken and customer support never answered any of my emails"))
+        self.assertEqual(index.stats(), {'reviews': 1, 'lookups': 2, 'saved_calls': 1})
+
+    def test_oldest_entries_are_evicted(self):
+        index = NearDuplicateIndex(threshold=0.9, capacity=2)
+        reviews = [
+            review,
+            "Arrived broken and customer support never answered any of my emails",
+            "The color faded after the first wash and the seams came apart within days",
+        ]
+        for i, text in enumerate(reviews):
+            index.add(text, ('Compliant', str(i), 'no'))
+
+        self.assertIsNone(index.find(reviews[0]))
+        self.assertEqual(index.find(reviews[1]), ('Compliant', '1', 'no'))
+        self.assertEqual(index.find(reviews[2]), ('Compliant', '2', 'no'))
+        self.assertNotIn(0, [ids for bucket in index.buckets for ids in bucket.values()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limiter
+from rate_limiter import LocalRateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def bucket(self, rate, level, updated=0.0):
+        bucket = TokenBucket(rate)
+        bucket.level = level
+        bucket.updated = updated
+        return bucket
+
+    def test_refills_in_proportion_to_elapsed_time(self):
+        bucket = self.bucket(600, 0.0)
+        bucket.refill(30.0)
+        self.assertAlmostEqual(bucket.level, 300.0)
+        self.assertEqual(bucket.updated, 30.0)
+
+    def test_refill_stops_at_the_rate(self):
+        bucket = self.bucket(600, 500.0)
+        bucket.refill(120.0)
+        self.assertEqual(bucket.level, 600)
+
+    def test_wait_time(self):
+        bucket = self.bucket(600, 100.0)
+        self.assertEqual(bucket.wait_time(100), 0.0)
+        self.assertAlmostEqual(bucket.wait_time(160), 6.0)
+
+
+class LocalRateLimiterTest(unittest.TestCase):
+
+    def test_acquire_waits_for_the_token_bucket(self):
+        clock = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            clock[0] += seconds
+
+        with mock.patch.object(rate_limiter.time, 'monotonic', lambda: clock[0]), \
+                mock.patch.object(rate_limiter.time, 'sleep', sleep):
+            limiter = LocalRateLimiter(rpm=60, tpm=600)
+            limiter.acquire(500)
+            limiter.acquire(200)
+
+        # 100 tokens left, 100 more come in after 10 seconds at 600/minute
+        self.assertEqual(len(waits), 1)
+        self.assertAlmostEqual(waits[0], 10.0)
+        self.assertAlmostEqual(limiter.tokens.level, 0.0)
+        self.assertAlmostEqual(limiter.requests.level, 59.0)
+
+    def test_acquire_more_than_the_rate_is_capped(self):
+        with mock.patch.object(rate_limiter.time, 'sleep', self.fail):
+            limiter = LocalRateLimiter(rpm=60, tpm=600)
+            limiter.acquire(10000)
+        self.assertLess(limiter.tokens.level, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler
+from scheduler import celery_priority, chunk_tags, clamp_priority
+
+
+class ChunkTagsTest(unittest.TestCase):
+
+    def test_tags_grow_by_chunk_rows(self):
+        self.assertEqual(chunk_tags([(1, 501), (501, 1001), (1001, 1031)], 100.0, 1), [600.0, 1100.0, 1130.0])
+
+    def test_priority_divides_the_tag_increments(self):
+        self.assertEqual(chunk_tags([(1, 501), (501, 1001)], 0.0, 2), [250.0, 500.0])
+
+    def test_small_upload_goes_before_the_rest_of_a_large_one(self):
+        large = chunk_tags([(start, start + 500) for start in range(1, 6001, 500)], 0.0, 1)
+        small = chunk_tags([(1, 31)], 0.0, 1)
+        self.assertLess(small[0], large[0])
+
+    def test_no_chunks(self):
+        self.assertEqual(chunk_tags([], 5.0, 1), [])
+
+
+class PriorityTest(unittest.TestCase):
+
+    def test_clamp_priority(self):
+        self.assertEqual(clamp_priority(None), scheduler.default_priority)
+        self.assertEqual(clamp_priority(0), 1)
+        self.assertEqual(clamp_priority(-3), 1)
+        self.assertEqual(clamp_priority('3'), 3)
+        self.assertEqual(clamp_priority(10 ** 6), scheduler.max_priority)
+
+    def test_celery_priority_round_robin(self):
+        self.assertEqual([celery_priority(index, 1) for index in range(4)], [0, 1, 2, 3])
+
+    def test_celery_priority_scaled_by_upload_priority(self):
+        self.assertEqual([celery_priority(index, 2) for index in range(6)], [0, 0, 1, 1, 2, 2])
+
+    def test_celery_priority_stays_within_redis_levels(self):
+        self.assertEqual(celery_priority(1000, 1), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
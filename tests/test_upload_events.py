@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upload_events import advance, chunk_bounds, format_cursor, last_row, parse_cursor
+
+
+class CursorTest(unittest.TestCase):
+
+    def test_plain_row_number(self):
+        self.assertEqual(parse_cursor(None), (1, {}))
+        self.assertEqual(parse_cursor('0'), (1, {}))
+        self.assertEqual(parse_cursor('250'), (251, {}))
+
+    def test_round_trip(self):
+        sent = {1001: 1200, 501: 700}
+        text = format_cursor(1, sent)
+        self.assertEqual(text, '1;501:700,1001:1200')
+        self.assertEqual(parse_cursor(text), (1, sent))
+        self.assertEqual(parse_cursor(format_cursor(501, {})), (501, {}))
+
+    def test_invalid_cursor_starts_over(self):
+        self.assertEqual(parse_cursor('abc'), (1, {}))
+        self.assertEqual(parse_cursor('1;501-700'), (1, {}))
+
+
+class ChunkBoundsTest(unittest.TestCase):
+
+    def test_running_upload_reads_up_to_each_checkpoint(self):
+        checkpoints = {'501': 620, '1': 500}
+        self.assertEqual(chunk_bounds(checkpoints, False), [(1, 500), (501, 620)])
+        self.assertEqual(chunk_bounds({}, False), [])
+
+    def test_final_upload_reads_every_chunk_in_full(self):
+        self.assertEqual(chunk_bounds({'1': 500, '501': 620}, True), [(1, 500), (501, last_row)])
+        self.assertEqual(chunk_bounds({}, True), [(1, last_row)])
+
+
+class AdvanceTest(unittest.TestCase):
+
+    def test_floor_stays_below_an_unfinished_chunk(self):
+        sent = {1: 300, 501: 1000}
+        self.assertEqual(advance(1, sent, [1, 501, 1001]), 1)
+        self.assertEqual(sent, {1: 300, 501: 1000})
+
+    def test_floor_moves_over_chunks_sent_in_full(self):
+        # The second chunk committed first; the first one catches up later
+        sent = {1: 500, 501: 1000, 1001: 1100}
+        self.assertEqual(advance(1, sent, [1, 501, 1001, 1501]), 1001)
+        self.assertEqual(sent, {1001: 1100})
+
+    def test_floor_inside_a_chunk(self):
+        # A cursor from ?after=250 starts in the middle of the first chunk
+        sent = {}
+        self.assertEqual(advance(251, sent, [1, 501]), 251)
+
+        sent = {1: 500}
+        self.assertEqual(advance(251, sent, [1, 501]), 501)
+        self.assertEqual(sent, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Resolve clear-cut violations locally instead of sending them to the model.
+# Only high-precision violation rules: a review without keyword hits may
+# still break guidelines that have no reliable keywords (1 and 2), so
+# nothing is judged Compliant here.
+triage_enabled = os.getenv('TRIAGE_ENABLED', '1') == '1'
+
+email_pattern = re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b')
+url_pattern = re.compile(
+    r'\b(?:https?://|www\.)\S+|\b[\w-]+\.(?:com|net|org|io|co|info|biz|shop|store)\b(?:/\S*)?',
+    re.IGNORECASE
+)
+amazon_pattern = re.compile(r'\bamazon\.[a-z.]+\b', re.IGNORECASE)
+# A phone number is written with separators, e.g. (555) 123-4567 or
+# 555.123.4567; ten bare digits are usually a model or order number and only
+# count after a word like "call" or "phone"
+phone_pattern = re.compile(
+    r'(?:\+?1[\s.-]?)?(?:\(\d{3}\)\s?|\b\d{3}[\s.-])\d{3}[\s.-]\d{4}\b'
+    r'|\b(?:call|phone|text|whatsapp|tel|cell)\b\W{0,3}(?:\w+\W{1,3}){0,2}\+?\d{10,11}\b',
+    re.IGNORECASE
+)
+
+# Common English and Spanish words; supported-language reviews contain some
+# (used by guideline_pruning.py)
+stopwords = {
+    'the', 'and', 'is', 'it', 'to', 'a', 'of', 'i', 'this', 'for', 'was', 'in', 'not', 'my', 'but', 'with',
+    'that', 'you', 'on', 'be', 'have', 'they', 'are', 'very', 'so', 'do', 'does', 'did', 'no', 'at', 'as',
+    'el', 'la', 'de', 'que', 'y', 'en', 'es', 'lo', 'los', 'las', 'un', 'una', 'por', 'para', 'muy', 'con',
+    'se', 'mi', 'pero', 'del', 'al', 'le', 'su', 'como', 'más', 'esta', 'este',
+}
+
+
+def detect_pii(review):
+    # Guideline numbers and labels for private information and external links
+    found = []
+
+    if email_pattern.search(review):
+        found.append((5, 'an email address'))
+    if phone_pattern.search(review):
+        found.append((5, 'a phone number'))
+
+    # Email domains are not links
+    text = email_pattern.sub(' ', review)
+    urls = [url for url in url_pattern.findall(text) if not amazon_pattern.search(url)]
+    if urls:
+        found.append((9, 'a link to an external site'))
+
+    return found
+
+
+def looks_supported_language(words):
+    # At least one in ten words is a common English or Spanish word
+    if not words:
+        return False
+    hits = sum(1 for word in words if word in stopwords)
+    return hits * 10 >= len(words)
+
+
+def triage(review):
+    # (status, reason, result) when the review clearly violates a guideline,
+    # None when it has to go to the model
+    pii = detect_pii(review)
+    if pii:
+        guidelines = sorted({num for num, label in pii})
+        labels = ', '.join(label for num, label in pii)
+        guideline_list = ', '.join(str(num) for num in guidelines)
+        return "Violation", f"The review contains {labels} (guideline {guideline_list}).", "yes"
+
+    words = re.findall(r'\w+', review.lower())
+
+    if not words:
+        return "Violation", "The review is only punctuation or symbols (guideline 4).", "yes"
+
+    return None
@@ -0,0 +1,71 @@
+import io
+
+# Labelled reviews in tune_data4 are unique by md5(review). The unique
+# expression index backs both the upsert below and review lookups.
+columns = ('review', 'ai_reason', 'ai_status', 'ai_result', 'human_reason', 'human_status', 'human_result')
+
+create_index_query = "CREATE UNIQUE INDEX IF NOT EXISTS tune_data4_review_md5 ON tune_data4 (md5(review))"
+
+exists_query = "SELECT 1 FROM tune_data4 WHERE md5(review) = md5(%s) LIMIT 1"
+
+column_limits_query = """
+SELECT column_name, character_maximum_length
+FROM information_schema.columns
+WHERE table_name = 'tune_data4' AND character_maximum_length IS NOT NULL
+"""
+
+
+def ensure_review_index(cursor):
+    cursor.execute(create_index_query)
+
+def ingest_labelled_reviews(conn, df):
+    # Bulk-load a DataFrame with the tune_data4 columns: COPY into a temp
+    # table, then one INSERT ... ON CONFLICT DO NOTHING into tune_data4.
+    # Returns (inserted rows, counts) where counts has inserted, skipped
+    # (already stored, duplicated or without review) and truncated (a value
+    # longer than its varchar column).
+    cursor = conn.cursor()
+    ensure_review_index(cursor)
+
+    cursor.execute(column_limits_query)
+    limits = {name: length for name, length in cursor.fetchall() if name in columns}
+
+    # Rows with values too long for tune_data4 are counted, not inserted
+    fits = ' AND '.join(f'(length({name}) <= {length} OR {name} IS NULL)' for name, length in limits.items()) or 'true'
+
+    buffer = io.StringIO()
+    df[list(columns)].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    conn.autocommit = False
+    try:
+        cursor.execute(f"CREATE TEMP TABLE tune_data4_staging ({', '.join(f'{name} TEXT' for name in columns)}) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY tune_data4_staging ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        staged = cursor.rowcount
+
+        cursor.execute(f"SELECT count(*) FROM tune_data4_staging WHERE review IS NOT NULL AND NOT ({fits})")
+        truncated = cursor.fetchone()[0]
+
+        cursor.execute(
+            f"""
+            INSERT INTO tune_data4 ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM tune_data4_staging
+            WHERE review IS NOT NULL AND {fits}
+            ON CONFLICT ((md5(review))) DO NOTHING
+            RETURNING {', '.join(columns)}
+            """
+        )
+        inserted_rows = cursor.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+    counts = {
+        'inserted': len(inserted_rows),
+        'skipped': staged - truncated - len(inserted_rows),
+        'truncated': truncated,
+    }
+    return inserted_rows, counts
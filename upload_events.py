@@ -0,0 +1,207 @@
+import os
+import json
+import bisect
+import threading
+
+from dotenv import load_dotenv
+
+import queries
+from db import connection
+from notify_listener import NotificationListener
+from results_table import ensure_summary_columns, events_channel, fetch_ranges, summary_columns
+
+load_dotenv()
+
+# Server-sent events for /events/<file_id>: workers NOTIFY upload_events
+# whenever rows are committed or the status changes (results_table.py), one
+# listener per API process wakes the streams of that upload, and each stream
+# reads only the rows it hasn't sent yet.
+#
+# Chunks of an upload run on different workers and commit out of row order,
+# so a stream keeps a cursor per chunk: rows below `floor` are all sent, and
+# {chunk start: last row sent} for the chunks above it. A chunk's rows are
+# only read up to its checkpoint in csv_upload.row_checkpoints, which moves
+# in the same statement that stores them, so no committed row is skipped.
+
+# Seconds between keep-alive comments on an idle stream
+keepalive = float(os.getenv('EVENTS_KEEPALIVE', '15'))
+# Rows per 'rows' event, and the most rows read per wake-up
+rows_per_event = int(os.getenv('EVENTS_ROWS', '200'))
+rows_per_read = rows_per_event * 10
+
+final_statuses = ('completed', 'failed')
+
+# Upper bound of the last chunk once the upload is final
+last_row = 2 ** 31 - 1
+
+
+class EventHub:
+    # Subscribers per upload id, each an Event set when the upload changed.
+    # Several notifications before a stream wakes collapse into one read.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.listener = None
+        self.listener_pid = None
+
+    def ensure_listener(self):
+        with self.lock:
+            if self.listener is not None and self.listener_pid == os.getpid() and self.listener.is_alive():
+                return
+            self.listener = NotificationListener([events_channel], self.handle, on_reconnect=self.wake_all)
+            self.listener_pid = os.getpid()
+            self.listener.start()
+
+    def subscribe(self, upload_id):
+        self.ensure_listener()
+        changed = threading.Event()
+        with self.lock:
+            self.subscribers.setdefault(upload_id, set()).add(changed)
+        return changed
+
+    def unsubscribe(self, upload_id, changed):
+        with self.lock:
+            waiting = self.subscribers.get(upload_id)
+            if waiting is not None:
+                waiting.discard(changed)
+                if not waiting:
+                    del self.subscribers[upload_id]
+
+    def handle(self, channel, payload):
+        try:
+            upload_id = json.loads(payload)['upload_id']
+        except (ValueError, KeyError):
+            return
+        with self.lock:
+            for changed in self.subscribers.get(upload_id, ()):
+                changed.set()
+
+    def wake_all(self):
+        # Notifications may have been missed while reconnecting
+        with self.lock:
+            for waiting in self.subscribers.values():
+                for changed in waiting:
+                    changed.set()
+
+
+event_hub = EventHub()
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+def parse_cursor(text):
+    # (floor, {chunk start: last row sent}) from an event id "floor;start:last,..."
+    # or from a plain row number, as ?after= takes
+    text = text or '0'
+    try:
+        if ';' not in text:
+            return int(text) + 1, {}
+        floor, chunks = text.split(';', 1)
+        return int(floor), dict(map(int, chunk.split(':')) for chunk in chunks.split(',') if chunk)
+    except ValueError:
+        return 1, {}
+
+def format_cursor(floor, sent):
+    return f"{floor};{','.join(f'{start}:{last}' for start, last in sorted(sent.items()))}"
+
+def chunk_bounds(checkpoints, final):
+    # [(start, hi)] per chunk in row order: its rows up to hi are committed.
+    # Once the upload is final all are, up to the next chunk's start.
+    starts = sorted(int(start) for start in checkpoints) or ([1] if final else [])
+    if not final:
+        return [(start, checkpoints[str(start)]) for start in starts]
+    return [(start, stop - 1) for start, stop in zip(starts, starts[1:] + [last_row + 1])]
+
+def advance(floor, sent, starts):
+    # Raise floor over the chunks sent in full, and forget the chunks below it
+    for start, next_start in zip(starts, starts[1:]):
+        if start <= floor < next_start and sent.get(start, start - 1) >= next_start - 1:
+            floor = next_start
+    for start, next_start in zip(starts, starts[1:]):
+        if next_start <= floor:
+            sent.pop(start, None)
+    return floor
+
+def read_changes(upload_id, floor, sent):
+    # ([up to rows_per_read rows not sent yet], summary, chunk bounds) with
+    # one pooled connection, checked out only for the read
+    with connection() as conn:
+        ensure_summary_columns(conn.cursor())
+        summary = queries.fetchone(conn, 'upload_summary', upload_id)
+        if summary is None:
+            return [], None, []
+        summary = dict(zip(('status',) + summary_columns, summary))
+
+        checkpoints = queries.fetchone(conn, 'upload_checkpoints', upload_id)[0] or {}
+        bounds = chunk_bounds(checkpoints, summary['status'] in final_statuses)
+        ranges = [(max(sent.get(start, start - 1), floor - 1), hi) for start, hi in bounds]
+        rows = fetch_ranges(conn, upload_id, [(lo, hi) for lo, hi in ranges if hi > lo], rows_per_read)
+
+    return rows, summary, bounds
+
+def stream_events(upload_id, cursor=None):
+    # SSE stream of an upload: 'rows' events with the rows committed since
+    # the last ones sent (the event id is the stream's cursor, so a
+    # reconnecting browser resumes via Last-Event-ID), 'progress' events
+    # with the counters, and a final 'end' event once the upload is
+    # completed or failed
+    floor, sent = parse_cursor(cursor)
+    changed = event_hub.subscribe(upload_id)
+    try:
+        yield 'retry: 3000\n\n'
+
+        while True:
+            changed.clear()
+            rows, summary, bounds = read_changes(upload_id, floor, sent)
+
+            if summary is None:
+                yield format_event('error', {'error': 'Invalid file ID'})
+                return
+
+            starts = [start for start, hi in bounds]
+            # Rows come in row order and the chunk ranges don't overlap, so
+            # each chunk gets a prefix of its range. If nothing was cut off
+            # by the limit, every chunk is sent up to its bound once the last
+            # batch is out.
+            complete = len(rows) < rows_per_read
+
+            for batch_start in range(0, len(rows) or 1, rows_per_event):
+                batch = rows[batch_start:batch_start + rows_per_event]
+                for row in batch:
+                    start = starts[bisect.bisect_right(starts, row[0]) - 1]
+                    sent[start] = max(sent.get(start, start - 1), row[0])
+                if complete and batch_start + rows_per_event >= len(rows):
+                    for start, hi in bounds:
+                        if hi >= floor:
+                            sent[start] = max(sent.get(start, start - 1), hi)
+                floor = advance(floor, sent, starts)
+
+                if batch:
+                    data = [
+                        {'row_no': row[0], 'status': row[1], 'reason': row[2], 'result': row[3]}
+                        for row in batch
+                    ]
+                    yield format_event('rows', data, format_cursor(floor, sent))
+
+            # More rows are waiting, e.g. when joining a finished upload
+            if not complete:
+                continue
+
+            yield format_event('progress', summary)
+
+            if summary['status'] in final_statuses:
+                yield format_event('end', {'status': summary['status']})
+                return
+
+            # Wait for the next commit, sending a comment now and then so
+            # proxies keep the connection open
+            while not changed.wait(keepalive):
+                yield ': keepalive\n\n'
+    finally:
+        event_hub.unsubscribe(upload_id, changed)
@@ -0,0 +1,177 @@
+import os
+import csv
+import time
+
+from google.cloud import storage
+from dotenv import load_dotenv
+
+import queries
+from db import connection
+from reviews import count_reviews, count_rows, find_review_columns, read_reviews
+from results_table import (
+    ResultWriter, checkpoint, ensure_results_table, notify_upload, recount_summary, set_checkpoint, start_summary, stored_rows,
+    summary_columns
+)
+
+load_dotenv()
+
+# The steps of an upload job, shared by the Celery tasks (tasks.py) and the
+# Postgres job queue (job_queue.py): prepare_upload splits the CSV into row
+# chunks, process_rows classifies one chunk, finish_upload merges the counts.
+# Every chunk checkpoints the rows it stored, so a rerun (resume=True, see
+# reaper.py) only classifies the rows that are missing.
+
+# CSV rows per chunk; every chunk is classified by whichever worker takes
+# it, so throughput grows with the number of worker processes
+chunk_rows = int(os.getenv('CHUNK_ROWS', '500'))
+
+bucket_name = os.getenv('BUCKET')
+# 'celery' (tasks.py, needs Redis) or 'postgres' (job_queue.py)
+job_backend = os.getenv('JOB_BACKEND', 'celery')
+
+count_keys = ('total', 'no', 'yes', 'maybe', 'n/a')
+
+
+def local_copy(filename):
+    # The upload downloaded from the GCS bucket once per worker host
+    temp_file_path = f"/tmp/{filename}"
+    if not os.path.exists(temp_file_path):
+        partial_path = f"{temp_file_path}.{os.getpid()}.part"
+        storage.Client().get_bucket(bucket_name).blob(filename).download_to_filename(partial_path)
+        os.replace(partial_path, temp_file_path)
+    return temp_file_path
+
+def fail_upload(conn, uuid):
+    queries.execute(conn, 'set_upload_status', uuid, "failed")
+    notify_upload(conn.cursor(), uuid, status="failed")
+
+def prepare_upload(uuid, filename, resume=False):
+    # (columns, [(start, stop)] row ranges) of the upload, or None if the CSV
+    # has no title, body and rating columns (the upload is marked failed).
+    # A resumed upload keeps its checkpoints and recounts its stored rows.
+    temp_file_path = local_copy(filename)
+
+    with open(temp_file_path, 'r') as csv_file:
+        columns = find_review_columns(csv.DictReader(csv_file).fieldnames)
+
+    with connection() as conn:
+        if columns is None:
+            print("Title, body, and/or ratings columns not found in the CSV file.")
+            fail_upload(conn, uuid)
+            return None
+
+        cursor = conn.cursor()
+        ensure_results_table(cursor)
+
+        # Progress counters in csv_upload, see /summary
+        if resume:
+            recount_summary(cursor, uuid, count_reviews(temp_file_path, columns))
+        else:
+            start_summary(cursor, uuid, count_reviews(temp_file_path, columns))
+
+    rows = count_rows(temp_file_path)
+    chunks = [(start, min(start + chunk_rows, rows + 1)) for start in range(1, rows + 1, chunk_rows)]
+    print(f"{uuid}: {rows} rows in {len(chunks)} chunks")
+    return columns, chunks
+
+def process_rows(conn, uuid, temp_file_path, columns, start, stop):
+    # Classify and store CSV rows start <= i < stop. Returns the counts of
+    # the classified rows and where their verdicts came from. Rows up to the
+    # chunk's checkpoint, or stored already by an earlier run, are skipped
+    # before they reach the model.
+    counts = dict.fromkeys(count_keys, 0)
+
+    cursor = conn.cursor()
+    done = checkpoint(cursor, uuid, start)
+    first = max(start, done + 1) if done is not None else start
+    stored = stored_rows(cursor, uuid, first, stop)
+    if first > start or stored:
+        print(f"{uuid}: chunk {start}-{stop - 1} resumes at row {first}, {len(stored)} more rows already stored")
+
+    # Prompt, classifier, triage and caches for this chunk. Imported here so
+    # the API process, which only enqueues jobs, doesn't load the model stack.
+    from pipeline import ReviewPipeline
+    pipeline = ReviewPipeline(conn)
+
+    with open(temp_file_path, 'r') as csv_file:
+        csv_reader = csv.DictReader(csv_file)
+        items = (item for item in read_reviews(csv_reader, columns, first, stop) if item[0] not in stored)
+        answers = pipeline.answers(items)
+
+        # Rows are buffered and written in bulk, in file order
+        with ResultWriter(conn, uuid, usage=lambda: pipeline.classifier.tokens_used, chunk=start) as writer:
+            for (i, review, needs_llm), verdict in answers:
+                if not needs_llm:
+                    writer.add(i, review, "N/A", "N/A", "N/A", "rating")
+                    continue
+
+                counts['total'] += 1
+                answer, source = verdict
+
+                print(i)
+                status, reason, result = pipeline.verdict(review, answer, source)
+                counts[result.lower()] += 1
+
+                writer.add(i, review, status, reason, result.lower(), source)
+
+    # The whole chunk is done, including trailing rows that were skipped
+    set_checkpoint(cursor, uuid, start, stop - 1)
+    conn.commit()
+
+    pipeline.print_stats(counts['total'])
+    return {'counts': counts, 'sources': pipeline.sources}
+
+def process_chunk(uuid, filename, columns, start, stop, enqueued_at=None):
+    # process_rows on a pooled connection; enqueued_at (epoch seconds) gives
+    # the chunk's queue wait, reported by finish_upload
+    wait = max(0.0, time.time() - enqueued_at) if enqueued_at else 0.0
+    print(f"{uuid}: chunk {start}-{stop - 1} waited {wait:.1f}s in the queue")
+
+    with connection() as conn:
+        result = process_rows(conn, uuid, local_copy(filename), columns, start, stop)
+
+    result['wait_s'] = round(wait, 2)
+    return result
+
+def finish_upload(results, uuid, filename):
+    # Merge the chunk results and mark the upload completed. The counts come
+    # from the upload's counters, which also cover rows stored by a run that
+    # stalled before this one.
+    sources = {}
+    waits = [result.get('wait_s', 0) for result in results]
+    for result in results:
+        for key, value in result['sources'].items():
+            sources[key] = sources.get(key, 0) + value
+
+    with connection() as conn:
+        summary = dict(zip(('status',) + summary_columns, queries.fetchone(conn, 'upload_summary', uuid)))
+    counts = {
+        'total': summary['yes_count'] + summary['no_count'] + summary['maybe_count'] + summary['na_count'],
+        'no': summary['no_count'],
+        'yes': summary['yes_count'],
+        'maybe': summary['maybe_count'],
+        'n/a': summary['na_count'],
+    }
+
+    # Print the counts
+    print("'Total' count:", counts['total'])
+    print("'No' count:", counts['no'])
+    print("'Yes' count:", counts['yes'])
+    print("'Maybe' count:", counts['maybe'])
+    print("'Not Applicable' count:", counts['n/a'])
+    print("Verdict sources:", sources)
+    queue_wait = {
+        'avg_s': round(sum(waits) / len(waits), 2) if waits else 0,
+        'max_s': max(waits, default=0),
+    }
+    print("Queue wait:", queue_wait)
+
+    with connection() as conn:
+        queries.execute(conn, 'set_upload_status', uuid, "completed")
+        notify_upload(conn.cursor(), uuid, status="completed")
+
+    # Clean up the temporary file on this host
+    if os.path.exists(f"/tmp/{filename}"):
+        os.remove(f"/tmp/{filename}")
+
+    return {'status': 'completed', 'counts': counts, 'sources': sources, 'queue_wait': queue_wait}
@@ -0,0 +1,169 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from psycopg2 import Error
+from dotenv import load_dotenv
+
+from dispatch import format_answer
+
+load_dotenv()
+
+# Number of verdicts kept in memory in front of the review_verdicts table
+lru_size = int(os.getenv('VERDICT_CACHE_SIZE', '10000'))
+
+# Verdicts of older prompt versions stay in review_verdicts but never match
+# again; delete them by prompt_version (or created_at) when the table grows.
+
+create_table_query = '''
+    CREATE TABLE IF NOT EXISTS review_verdicts (
+        key CHAR(64) PRIMARY KEY,
+        prompt_version CHAR(64) NOT NULL,
+        model VARCHAR NOT NULL,
+        status VARCHAR,
+        reason VARCHAR,
+        result VARCHAR,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS review_verdicts_prompt_version_idx ON review_verdicts (prompt_version);
+'''
+
+
+table_ready = False
+
+# In-process LRU of the current (prompt version, model), shared by every job
+# of this process so a re-uploaded review is served without a round trip.
+# Dropped when the version or model changes, like pipeline.near_dupe_indexes.
+lrus = {}
+lru_lock = threading.Lock()
+
+
+def get_lru(version, model):
+    with lru_lock:
+        if (version, model) not in lrus:
+            lrus.clear()
+            lrus[(version, model)] = OrderedDict()
+        return lrus[(version, model)]
+
+
+def ensure_verdict_table(conn):
+    # Create review_verdicts once per process
+    global table_ready
+    if not table_ready:
+        conn.cursor().execute(create_table_query)
+        conn.commit()
+        table_ready = True
+
+
+def normalize_review(review):
+    # Case, surrounding and repeated whitespace don't change the verdict
+    return re.sub(r'\s+', ' ', review).strip().lower()
+
+
+def prompt_version(guidelines_prompt):
+    # The rendered prefix contains both guide.py and the tune_data4 examples,
+    # so editing either one produces a new version and old verdicts stop matching
+    return hashlib.sha256(guidelines_prompt.encode('utf-8')).hexdigest()
+
+
+def cache_key(review, version, model):
+    text = f"{version}\n{model}\n{normalize_review(review)}"
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class VerdictCache:
+    # Verdicts of already classified reviews, keyed by review text, prompt
+    # version and model. The process-wide LRU (get_lru) sits in front of
+    # Postgres; hit counts are per job.
+
+    def __init__(self, conn, guidelines_prompt, model, size=None):
+        self.conn = conn
+        self.version = prompt_version(guidelines_prompt)
+        self.model = model
+        self.size = lru_size if size is None else size
+        self.lru = get_lru(self.version, self.model)
+        self.lock = lru_lock
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+        ensure_verdict_table(conn)
+
+    def remember(self, key, verdict):
+        with self.lock:
+            self.lru[key] = verdict
+            self.lru.move_to_end(key)
+            if len(self.lru) > self.size:
+                self.lru.popitem(last=False)
+
+    def get(self, review):
+        # (status, reason, result) for a review seen before, otherwise None
+        key = cache_key(review, self.version, self.model)
+
+        with self.lock:
+            verdict = self.lru.get(key)
+            if verdict is not None:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                return verdict
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT status, reason, result FROM review_verdicts WHERE key = %s",
+                (key,)
+            )
+            row = cursor.fetchone()
+        except Error as e:
+            print('Error reading the verdict cache:', e)
+            row = None
+
+        if row is None:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        verdict = tuple(row)
+        self.remember(key, verdict)
+        with self.lock:
+            self.db_hits += 1
+        return verdict
+
+    def get_answer(self, review):
+        # Cached verdict rendered like a model answer, so parse_answer applies
+        verdict = self.get(review)
+        if verdict is None:
+            return None
+        return format_answer(*verdict)
+
+    def put(self, review, status, reason, result):
+        key = cache_key(review, self.version, self.model)
+
+        with self.lock:
+            if key in self.lru:
+                return
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "INSERT INTO review_verdicts (key, prompt_version, model, status, reason, result) "
+                "VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (key) DO NOTHING",
+                (key, self.version, self.model, status, reason, result)
+            )
+            self.conn.commit()
+        except Error as e:
+            print('Error writing the verdict cache:', e)
+            return
+
+        self.remember(key, (status, reason, result))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'size': len(self.lru),
+            }